@@ -0,0 +1,59 @@
+"""
+Time the vendored YAML scanner on generated documents of growing size.
+
+The time per line should stay about the same from 10k to 1M lines. To
+compare with another version, check it out separately and pass its
+directory, e.g.
+
+    git worktree add /tmp/before <commit>
+    python bench/yaml_scan.py --tree /tmp/before 10000 100000
+    python bench/yaml_scan.py 10000 100000
+
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def document(lines):
+    """Return a document of `lines` lines of block and flow collections"""
+    result = []
+    i = 0
+    while len(result) < lines:
+        result.append('key{0}: value {0}'.format(i))
+        result.append('list{0}: [a, b, "c", {{x: 1}}]'.format(i))
+        result.append('map{0}:'.format(i))
+        result.append('  - item: {0}'.format(i))
+        result.append('    other: text')
+        i += 1
+    return '\n'.join(result[:lines]) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the vendored YAML scanner.')
+    parser.add_argument('lines', type=int, nargs='*',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--tree', default=ROOT,
+                        help='panwrap checkout to benchmark')
+    args = parser.parse_args()
+    sys.path.insert(0, args.tree)
+    from lib import yaml
+
+    for lines in args.lines:
+        data = document(lines)
+        start = time.time()
+        tokens = 0
+        for _ in yaml.scan(data):
+            tokens += 1
+        elapsed = time.time() - start
+        print('{:8d} lines {:8d} tokens {:7.2f} s {:7.2f} us/line'.format(
+            lines, tokens, elapsed, elapsed / lines * 1e6))
+
+
+if __name__ == '__main__':
+    main()
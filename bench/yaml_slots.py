@@ -0,0 +1,62 @@
+"""
+Measure the memory held by the tokens, events and nodes of the vendored
+YAML library, and the time to compose a document from them.
+
+To compare with another version, check it out separately and pass its
+directory, e.g.
+
+    git worktree add /tmp/before <commit>
+    python bench/yaml_slots.py --tree /tmp/before
+    python bench/yaml_slots.py
+
+Needs Python 3.4 or later for tracemalloc.
+
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def document(lines):
+    """Return a document of `lines` lines of flow mappings"""
+    return '\n'.join('k{0}: {{a: [1, 2, three], b: "quoted {0}", '
+                     'c: plain text here {0}}}'.format(i)
+                     for i in range(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure YAML token, event and node sizes.')
+    parser.add_argument('lines', type=int, nargs='?', default=5000)
+    parser.add_argument('--tree', default=ROOT,
+                        help='panwrap checkout to benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    sys.path.insert(0, args.tree)
+    from lib import yaml
+
+    data = document(args.lines)
+    tracemalloc.start()
+    kept = (list(yaml.scan(data)), list(yaml.parse(data)), yaml.compose(data))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    print('tokens, events and nodes: {:.1f} MB'.format(memory / 1e6))
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.time()
+        yaml.compose(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('compose {} lines: {:.0f} ms (best of {})'.format(
+        args.lines, best * 1000, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
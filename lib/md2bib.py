@@ -10,46 +10,475 @@ Joseph Reagle and licensed under the GPLv3.
 """
 
 from collections import OrderedDict
+import bisect
+import json
 import logging
+import os
 import re
+import unicodedata
 
 
-def parse_bibtex(text):
+class BibEntry(OrderedDict):
+    """Dictionary of field/value pairs of a single bibtex entry, which
+    also remembers the entry's original text so that unmodified entries
+    can be written back verbatim.
+
+    """
+    _raw = None
+    _raw_state = None
+
+    def set_original_text(self, identifier, raw):
+        self._raw = raw
+        self._raw_state = (identifier, tuple(self.items()))
+
+    def original_text(self, identifier):
+        """Return the original text of the entry, or None if the entry
+        was changed or renamed since it was parsed.
+
+        """
+        if self._raw is None:
+            return None
+        if (identifier, tuple(self.items())) != self._raw_state:
+            return None
+        return self._raw
+
+
+# Required fields per entry type, with alternatives given as tuples. The
+# alternatives include the biblatex names of fields (journaltitle, date).
+JOURNAL = ('journal', 'journaltitle')
+YEAR = ('year', 'date')
+REQUIRED_FIELDS = {
+    'article': ['author', 'title', JOURNAL, YEAR],
+    'book': [('author', 'editor'), 'title', 'publisher', YEAR],
+    'booklet': ['title'],
+    'inbook': [('author', 'editor'), 'title', ('chapter', 'pages'),
+               'publisher', YEAR],
+    'incollection': ['author', 'title', 'booktitle', 'publisher', YEAR],
+    'inproceedings': ['author', 'title', 'booktitle', YEAR],
+    'conference': ['author', 'title', 'booktitle', YEAR],
+    'manual': ['title'],
+    'mastersthesis': ['author', 'title', ('school', 'institution'), YEAR],
+    'phdthesis': ['author', 'title', ('school', 'institution'), YEAR],
+    'proceedings': ['title', YEAR],
+    'techreport': ['author', 'title', 'institution', YEAR],
+    'unpublished': ['author', 'title', 'note'],
+}
+
+# Entry types that do not hold references
+NON_ENTRY_TYPES = ['comment', 'preamble', 'string']
+
+
+class BibReport(object):
+    """Problems found while parsing a bibtex file: duplicate keys,
+    unparseable entries and fields, and entries missing required fields.
+
+    """
+    def __init__(self):
+        self.duplicates = OrderedDict()  # key: line numbers of all entries
+        self.unparseable = []  # (line number, line)
+        self.missing_fields = OrderedDict()  # key: list of missing fields
+
+    def check_required_fields(self, entries):
+        for key, values in entries.items():
+            fields = [f.lower() for f in values]
+            required = REQUIRED_FIELDS.get(values['entry_type'].lower(), [])
+            missing = []
+            for field in required:
+                if isinstance(field, tuple):
+                    if not any(f in fields for f in field):
+                        missing.append('/'.join(field))
+                elif field not in fields:
+                    missing.append(field)
+            if missing:
+                self.missing_fields[key] = missing
+
+    def __bool__(self):
+        return bool(self.duplicates or self.unparseable
+                    or self.missing_fields)
+
+    def __str__(self):
+        lines = []
+        if self.duplicates:
+            lines.append('Duplicate keys (the last entry is used):')
+            for key, line_numbers in self.duplicates.items():
+                lines.append('    {} (lines {})'.format(
+                             key, ', '.join(str(i) for i in line_numbers)))
+        if self.unparseable:
+            lines.append('Unparseable entries or fields (ignored):')
+            for line_number, line in self.unparseable:
+                lines.append('    line {}: {}'.format(line_number,
+                                                      line.strip()))
+        if self.missing_fields:
+            lines.append('Entries missing required fields:')
+            for key, missing in self.missing_fields.items():
+                lines.append('    {}: {}'.format(key, ', '.join(missing)))
+        if not lines:
+            lines.append('No problems found.')
+        return '\n'.join(lines)
+
+
+def parse_bibtex(text, report=None):
     """Return a dictionary of entry dictionaries, each with a field/value.
     The parser is simple/fast *and* inflexible, unlike the proper but
     slow parsers bibstuff and pyparsing-based parsers.
 
+    The original text of each entry ending in a line with a lone `}` is
+    kept with the entry (see BibEntry).
+
+    If a BibReport is given as `report`, problems found while parsing
+    are recorded in it.
+
     """
     entries = OrderedDict()
     key_pat = re.compile('@(\w+){(.*),')
     value_pat = re.compile('[\s]*(\w+)[\s]*=[\s]*{(.*)},?')
-    for line in text:
+    field_pat = re.compile('[\s]*(\w+)[\s]*=')
+    entry_lines = {}
+    raw_lines = None
+    for line_number, line in enumerate(text, 1):
         key_match = key_pat.match(line)
         if key_match:
             entry_type = key_match.group(1)
             key = key_match.group(2)
-            entries[key] = OrderedDict({'entry_type': entry_type})
+            if report is not None:
+                if key in entry_lines:
+                    report.duplicates.setdefault(key, [entry_lines[key]])
+                    report.duplicates[key].append(line_number)
+                entry_lines[key] = line_number
+            entries[key] = BibEntry({'entry_type': entry_type})
+            raw_lines = [line]
             continue
         value_match = value_pat.match(line)
         if value_match:
             field, value = value_match.groups()
             entries[key][field] = value
+        elif line.startswith('@'):
+            # Not an entry we can parse, so stop capturing the previous one
+            raw_lines = None
+            entry_type = line[1:].split('{')[0].strip().lower()
+            if report is not None and entry_type not in NON_ENTRY_TYPES:
+                report.unparseable.append((line_number, line))
+        elif report is not None and raw_lines is not None:
+            if field_pat.match(line):
+                report.unparseable.append((line_number, line))
+        if raw_lines is not None:
+            raw_lines.append(line)
+            if line.rstrip() == '}':
+                raw = ''.join(raw_lines).rstrip('\n') + '\n\n'
+                entries[key].set_original_text(key, raw)
+                raw_lines = None
+    if report is not None:
+        report.check_required_fields(entries)
     return entries
 
 
+class BibIndex(object):
+    """In-memory index of a bibtex file, to look up entry keys by a prefix
+    of the key itself or of a word in the entry's author or title.
+
+    The entries and the BibReport generated while parsing are kept as
+    `entries` and `report`.
+
+    """
+    def __init__(self, source_bib):
+        self.source_bib = source_bib
+        self.mtime = os.path.getmtime(source_bib)
+        self.report = BibReport()
+        with open(source_bib, 'r', encoding='utf-8') as f:
+            self.entries = parse_bibtex(f, report=self.report)
+        # Map each word to the keys of the entries it appears in, and keep
+        # the words sorted so that a prefix can be found by bisection
+        self._keys = {}
+        word_pat = re.compile(r'\w+')
+        for key, values in self.entries.items():
+            text = values.get('author', '') + ' ' + values.get('title', '')
+            words = set(word_pat.findall(text.lower()))
+            words.add(key.lower())
+            for word in words:
+                self._keys.setdefault(word, []).append(key)
+        self._words = sorted(self._keys)
+
+    def is_stale(self):
+        """Return True if the bibtex file changed since it was indexed"""
+        try:
+            return os.path.getmtime(self.source_bib) != self.mtime
+        except OSError:
+            return True
+
+    def search(self, prefix, limit=100):
+        """Return up to `limit` keys of entries matching `prefix`."""
+        prefix = prefix.lower()
+        keys = OrderedDict()
+        i = bisect.bisect_left(self._words, prefix)
+        while i < len(self._words) and len(keys) < limit:
+            word = self._words[i]
+            if not word.startswith(prefix):
+                break
+            for key in self._keys[word]:
+                keys[key] = None
+            i += 1
+        return list(keys)[:limit]
+
+    def describe(self, key):
+        """Return a short `author year: title` description of an entry."""
+        values = self.entries[key]
+        author = ''
+        names = values.get('author', values.get('editor'))
+        if names:
+            first = _csl_names(names)[0]
+            author = first.get('family', first.get('literal'))
+        return '{} {}: {}'.format(author, values.get('year', ''),
+                                  _csl_text(values.get('title', '')))
+
+
+# Approximate size (in characters) of the blocks written by emit_bibliography
+CHUNK_SIZE = 1 << 16
+
+
+def format_entry(identifier, values):
+    """Return a single bibtex entry as text."""
+    if isinstance(values, BibEntry):
+        raw = values.original_text(identifier)
+        if raw is not None:
+            return raw
+    fields = ['    %s = {%s},\n' % (field, value)
+              for field, value in values.items() if field != 'entry_type']
+    return '@%s{%s,\n%s}\n\n' % (values['entry_type'], identifier,
+                                  ''.join(fields))
+
+
 def emit_entry(identifier, values, outfd):
     """Emit a single bibtex entry."""
-    outfd.write('@%s{%s,\n' % (values['entry_type'], identifier))
-    for field, value in values.items():
-        if field != 'entry_type':
-            outfd.write('    %s = {%s},\n' % (field, value))
-    outfd.write("}\n\n")
+    outfd.write(format_entry(identifier, values))
 
 
-def emit_bibliography(entries, outfd):
-    """Emit a bibtex file."""
+def emit_bibliography(entries, outfd, chunk_size=CHUNK_SIZE):
+    """Emit a bibtex file. Entries are collected and written to outfd in
+    blocks of about chunk_size characters. If chunk_size is None, each
+    entry is streamed straight to outfd instead.
+
+    """
+    if chunk_size is None:
+        for identifier, values in entries.items():
+            emit_entry(identifier, values, outfd)
+        return
+    chunk = []
+    size = 0
     for identifier, values in entries.items():
-        emit_entry(identifier, values, outfd)
+        entry = format_entry(identifier, values)
+        chunk.append(entry)
+        size += len(entry)
+        if size >= chunk_size:
+            outfd.write(''.join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        outfd.write(''.join(chunk))
+
+
+# Mapping of BibTeX entry types to CSL item types
+CSL_TYPES = {
+    'article': 'article-journal',
+    'book': 'book',
+    'booklet': 'pamphlet',
+    'conference': 'paper-conference',
+    'inbook': 'chapter',
+    'incollection': 'chapter',
+    'inproceedings': 'paper-conference',
+    'manual': 'book',
+    'mastersthesis': 'thesis',
+    'misc': 'article',
+    'online': 'webpage',
+    'phdthesis': 'thesis',
+    'proceedings': 'book',
+    'techreport': 'report',
+    'thesis': 'thesis',
+    'unpublished': 'manuscript',
+}
+
+# Mapping of BibTeX fields to CSL variables that can be copied verbatim
+CSL_FIELDS = {
+    'abstract': 'abstract',
+    'address': 'publisher-place',
+    'booktitle': 'container-title',
+    'edition': 'edition',
+    'institution': 'publisher',
+    'journal': 'container-title',
+    'journaltitle': 'container-title',
+    'keywords': 'keyword',
+    'location': 'publisher-place',
+    'note': 'note',
+    'organization': 'publisher',
+    'publisher': 'publisher',
+    'school': 'publisher',
+    'series': 'collection-title',
+    'title': 'title',
+    'volume': 'volume',
+}
+
+# Mapping of BibTeX fields to CSL variables holding identifiers, which are
+# copied without any conversion
+CSL_VERBATIM_FIELDS = {
+    'doi': 'DOI',
+    'isbn': 'ISBN',
+    'issn': 'ISSN',
+    'url': 'URL',
+}
+
+MONTHS = {m: i + 1 for i, m in enumerate(['jan', 'feb', 'mar', 'apr', 'may',
+                                          'jun', 'jul', 'aug', 'sep', 'oct',
+                                          'nov', 'dec'])}
+
+# Cache of converted CSL items, keyed by entry key and its field values,
+# so that repeated extractions from the same library convert each entry once.
+# The cache is cleared when it reaches CSL_CACHE_SIZE items.
+_csl_cache = {}
+CSL_CACHE_SIZE = 4096
+
+# Combining characters for LaTeX accent macros
+ACCENTS = {
+    '"': '\u0308', "'": '\u0301', '`': '\u0300', '^': '\u0302',
+    '~': '\u0303', '=': '\u0304', '.': '\u0307', 'u': '\u0306',
+    'v': '\u030c', 'H': '\u030b', 'c': '\u0327', 'k': '\u0328',
+    'r': '\u030a',
+}
+
+# LaTeX macros for letters
+LETTERS = {
+    'ss': '\u00df', 'o': '\u00f8', 'O': '\u00d8', 'aa': '\u00e5',
+    'AA': '\u00c5', 'ae': '\u00e6', 'AE': '\u00c6', 'oe': '\u0153',
+    'OE': '\u0152', 'l': '\u0142', 'L': '\u0141', 'i': '\u0131',
+    'j': '\u0237',
+}
+
+# An accent macro and its letter, optionally in braces as in `{\"u}`:
+# `\"u`, `\"{u}`, `\'\i`, `\v c`, `\c{c}`
+ACCENT_PAT = re.compile(r'(\{)?\\(?:([^\w\s])\s*|([uvHckr])(?:\s+|(?=\{)))'
+                        r'(?:\{(\\[a-zA-Z]+|\w)\}|(\\[a-zA-Z]+|\w))(?(1)\})')
+# A letter macro, optionally in braces: `\ss`, `{\o}`, `\ae{}`
+LETTER_PAT = re.compile(r'(\{)?\\(ss|aa|AA|ae|AE|oe|OE|[oOlLij])'
+                        r'(?![a-zA-Z])(?:\{\}|\s*)(?(1)\})')
+
+
+def _decode_accent(match):
+    accent = match.group(2) or match.group(3)
+    letter = match.group(4) or match.group(5)
+    if accent not in ACCENTS:
+        return match.group(0)
+    if letter.startswith('\\'):
+        if letter[1:] not in LETTERS:
+            return match.group(0)
+        letter = LETTERS[letter[1:]]
+    if letter in '\u0131\u0237' and accent not in ['c', 'k']:
+        # Dotless letters only avoid a double dot under the accent
+        letter = {'\u0131': 'i', '\u0237': 'j'}[letter]
+    return unicodedata.normalize('NFC', letter + ACCENTS[accent])
+
+
+def _decode_letter(match):
+    return LETTERS[match.group(2)]
+
+
+def _csl_text(value, nocase=False):
+    """Convert BibTeX text to plain text, decoding the most common LaTeX
+    escapes and accents. If `nocase` is True, text protected by braces is
+    marked with `<span class="nocase">` as CSL expects, otherwise the
+    braces are removed."""
+    value = ACCENT_PAT.sub(_decode_accent, value)
+    value = LETTER_PAT.sub(_decode_letter, value)
+    for escaped in ['&', '%', '$', '#', '_']:
+        value = value.replace('\\' + escaped, escaped)
+    value = value.replace('---', '\u2014').replace('--', '\u2013')
+    if not nocase:
+        return value.replace('{', '').replace('}', '').strip()
+    # Only the outermost braces protect text, inner ones are dropped
+    chunks = []
+    depth = 0
+    for c in value:
+        if c == '{':
+            if depth == 0:
+                chunks.append('<span class="nocase">')
+            depth += 1
+        elif c == '}':
+            if depth == 1:
+                chunks.append('</span>')
+            depth = max(depth - 1, 0)
+        else:
+            chunks.append(c)
+    if depth > 0:
+        chunks.append('</span>')
+    return ''.join(chunks).strip()
+
+
+def _csl_names(value):
+    """Convert a BibTeX name list (`A and B`) to a list of CSL names."""
+    names = []
+    for name in re.split(r'\s+and\s+', value.strip()):
+        if name.startswith('{') and name.endswith('}'):
+            # Names in braces are institutions and must not be split
+            names.append({'literal': _csl_text(name)})
+        elif ',' in name:
+            family, given = name.split(',', 1)
+            names.append({'family': _csl_text(family),
+                          'given': _csl_text(given)})
+        elif ' ' in name.strip():
+            given, family = name.strip().rsplit(' ', 1)
+            names.append({'family': _csl_text(family),
+                          'given': _csl_text(given)})
+        else:
+            names.append({'family': _csl_text(name)})
+    return names
+
+
+def entry_to_csl(identifier, values):
+    """Return the CSL-JSON item for a single parsed bibtex entry.
+    Converted items are cached, so each entry is only converted once
+    as long as its fields do not change.
+
+    """
+    cache_key = (identifier, tuple(values.items()))
+    if cache_key in _csl_cache:
+        return _csl_cache[cache_key]
+    entry_type = values['entry_type'].lower()
+    item = OrderedDict([('id', identifier),
+                        ('type', CSL_TYPES.get(entry_type, 'article'))])
+    date_parts = []
+    for field, value in values.items():
+        field = field.lower()
+        if field in ['author', 'editor', 'translator']:
+            item[field] = _csl_names(value)
+        elif field in CSL_FIELDS:
+            item.setdefault(CSL_FIELDS[field], _csl_text(value, nocase=True))
+        elif field in CSL_VERBATIM_FIELDS:
+            item.setdefault(CSL_VERBATIM_FIELDS[field], value.strip())
+        elif field == 'number':
+            if entry_type == 'article':
+                item['issue'] = _csl_text(value)
+            else:
+                item['number'] = _csl_text(value)
+        elif field == 'pages':
+            item['page'] = _csl_text(value).replace('\u2013', '-')
+        elif field == 'year':
+            date_parts.insert(0, _csl_text(value))
+        elif field == 'month':
+            month = _csl_text(value).lower()[:3]
+            date_parts.append(MONTHS.get(month, month))
+    if date_parts:
+        try:
+            item['issued'] = {'date-parts': [[int(i) for i in date_parts]]}
+        except ValueError:
+            item['issued'] = {'literal': ' '.join(str(i) for i in date_parts)}
+    if len(_csl_cache) >= CSL_CACHE_SIZE:
+        _csl_cache.clear()
+    _csl_cache[cache_key] = item
+    return item
+
+
+def emit_csl_json(entries, outfd):
+    """Emit a CSL-JSON file."""
+    items = [entry_to_csl(identifier, values)
+             for identifier, values in entries.items()]
+    json.dump(items, outfd, ensure_ascii=False, indent=2)
 
 
 def subset_bibliography(entries, keys):
@@ -79,7 +508,12 @@ def get_keys_from_document(filename, include_bibtex_style=False):
 
 
 def extract_bibliography(source_doc, source_bib, target_bib,
-                         include_bibtex_style=False):
+                         include_bibtex_style=False, output_format='bibtex'):
+    """Write the entries of `source_bib` cited in `source_doc` to
+    `target_bib`, either as BibTeX or, if output_format='csl-json',
+    as CSL-JSON, which pandoc-citeproc reads much faster than BibTeX.
+
+    """
     # Extract citation keys from source file
     keys = get_keys_from_document(source_doc)
     # Read source bibliography and generate subset
@@ -88,4 +522,7 @@ def extract_bibliography(source_doc, source_bib, target_bib,
     subset = subset_bibliography(entries, keys)
     # Write extracted subset to new bibliography file
     with open(target_bib, 'w', encoding='utf-8') as f:
-        emit_bibliography(subset, f)
+        if output_format == 'csl-json':
+            emit_csl_json(subset, f)
+        else:
+            emit_bibliography(subset, f)
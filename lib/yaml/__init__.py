@@ -5,8 +5,11 @@ from .tokens import *
 from .events import *
 from .nodes import *
 
+from .reader import Reader
 from .loader import *
+from .flatloader import *
 from .dumper import *
+from .flatdumper import *
 
 __version__ = '3.10'
 try:
@@ -15,7 +18,7 @@ try:
 except ImportError:
     __with_libyaml__ = False
 
-import io
+import io, sys
 
 def scan(stream, Loader=Loader):
     """
@@ -93,6 +96,65 @@ def safe_load(stream):
     """
     return load(stream, SafeLoader)
 
+def load_keys(stream, keys, Loader=Loader):
+    """
+    Parse the first YAML document in a stream
+    and produce the corresponding Python object.
+    If the document is a mapping, produce only the values of the
+    given string keys; the other values are parsed but not constructed.
+    """
+    loader = Loader(stream)
+    try:
+        return loader.get_single_selected_data(keys)
+    finally:
+        loader.dispose()
+
+def safe_load_keys(stream, keys):
+    """
+    Parse the first YAML document in a stream
+    and produce the corresponding Python object.
+    If the document is a mapping, produce only the values of the
+    given string keys; the other values are parsed but not constructed.
+    Resolve only basic YAML tags.
+    Flat mappings of scalars in strings are loaded without the full
+    SafeLoader.
+    """
+    if isinstance(stream, str):
+        try:
+            data = FlatLoader().load(stream)
+        except (YAMLError, ValueError):
+            # Not flat, or one of the values does not construct; only the
+            # selected values have to.
+            pass
+        else:
+            if type(data) is dict:
+                data = dict((key, value) for key, value in data.items()
+                            if key in keys)
+            return data
+    return load_keys(stream, keys, SafeLoader)
+
+def safe_load_flat(stream):
+    """
+    Parse the first YAML document in a stream
+    and produce the corresponding Python object.
+    Resolve only basic YAML tags.
+    Flat mappings of scalars are loaded without the full SafeLoader.
+    """
+    if isinstance(stream, str):
+        data = stream
+    else:
+        # Decode the whole stream the way SafeLoader would.
+        reader = Reader(stream)
+        reader.update(sys.maxsize)
+        data = reader.buffer[reader.pointer:-1]
+        if reader.stream is not None:
+            stream = io.StringIO(data)
+            stream.name = reader.name
+    try:
+        return FlatLoader().load(data)
+    except FlatLoaderFallback:
+        return load(stream, SafeLoader)
+
 def safe_load_all(stream):
     """
     Parse all YAML documents in a stream
@@ -199,6 +261,54 @@ def dump(data, stream=None, Dumper=Dumper, **kwds):
     """
     return dump_all([data], stream, Dumper=Dumper, **kwds)
 
+def dump_flat(data, stream=None):
+    """
+    Serialize a Python object into a YAML stream.
+    If stream is None, return the produced string instead.
+    Flat mappings of scalars are written without the full Dumper.
+    """
+    try:
+        text = FlatDumper().dump(data)
+    except FlatDumperFallback:
+        return dump(data, stream)
+    if stream is None:
+        return text
+    stream.write(text)
+
+def dump_all_incremental(documents, stream=None, Dumper=Dumper, **kwds):
+    """
+    Serialize a sequence of Python objects into a YAML stream,
+    writing each object out while it is walked.
+    Dicts, lists and generators are not represented as a whole,
+    and objects that appear more than once are not aliased.
+    If stream is None, return the produced string instead.
+    """
+    getvalue = None
+    if stream is None:
+        if kwds.get('encoding') is None:
+            stream = io.StringIO()
+        else:
+            stream = io.BytesIO()
+        getvalue = stream.getvalue
+    dumper = Dumper(stream, **kwds)
+    try:
+        dumper.open()
+        for data in documents:
+            dumper.represent_incrementally(data)
+        dumper.close()
+    finally:
+        dumper.dispose()
+    if getvalue:
+        return getvalue()
+
+def dump_incremental(data, stream=None, Dumper=Dumper, **kwds):
+    """
+    Serialize a Python object into a YAML stream,
+    writing it out while it is walked.
+    If stream is None, return the produced string instead.
+    """
+    return dump_all_incremental([data], stream, Dumper=Dumper, **kwds)
+
 def safe_dump_all(documents, stream=None, **kwds):
     """
     Serialize a sequence of Python objects into a YAML stream.
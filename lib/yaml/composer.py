@@ -47,6 +47,68 @@ class Composer:
 
         return document
 
+    def get_single_selected_node(self, keys):
+        # Like get_single_node, but if the document is a mapping, compose
+        # only the pairs whose keys are among the strings `keys`, and merge
+        # keys. The other values are skipped without being composed.
+        self.get_event()
+        document = None
+        if not self.check_event(StreamEndEvent):
+            # Drop the DOCUMENT-START event.
+            self.get_event()
+            if self.check_event(MappingStartEvent):
+                document = self.compose_selected_mapping_node(keys)
+            else:
+                document = self.compose_node(None, None)
+            # Drop the DOCUMENT-END event.
+            self.get_event()
+            self.shared_nodes = bool(self.anchors)
+            self.anchors = {}
+        if not self.check_event(StreamEndEvent):
+            event = self.get_event()
+            raise ComposerError("expected a single document in the stream",
+                    document.start_mark, "but found another document",
+                    event.start_mark)
+        self.get_event()
+        return document
+
+    def compose_selected_mapping_node(self, keys):
+        anchor = self.peek_event().anchor
+        self.descend_resolver(None, None)
+        node = self.compose_mapping_node(anchor)
+        while not self.check_event(MappingEndEvent):
+            item_key = self.compose_node(node, None)
+            if isinstance(item_key, ScalarNode)   \
+                    and (item_key.tag == 'tag:yaml.org,2002:merge'
+                        or (item_key.tag == 'tag:yaml.org,2002:str'
+                            and item_key.value in keys)):
+                item_value = self.compose_node(node, item_key)
+                node.value.append((item_key, item_value))
+            else:
+                self.skip_node()
+        end_event = self.get_event()
+        node.end_mark = end_event.end_mark
+        self.ascend_resolver()
+        return node
+
+    def skip_node(self):
+        # Drop the events of a node. Anchored nodes inside it are composed
+        # all the same, since aliases further on may refer to them.
+        depth = 0
+        while True:
+            event = self.peek_event()
+            if isinstance(event, (ScalarEvent, CollectionStartEvent))  \
+                    and event.anchor is not None:
+                self.compose_node(None, None)
+            else:
+                self.get_event()
+                if isinstance(event, CollectionStartEvent):
+                    depth += 1
+                elif isinstance(event, CollectionEndEvent):
+                    depth -= 1
+            if not depth:
+                return
+
     def compose_document(self):
         # Drop the DOCUMENT-START event.
         self.get_event()
@@ -57,33 +119,72 @@ class Composer:
         # Drop the DOCUMENT-END event.
         self.get_event()
 
+        # Without anchors every node appears once in the document, so the
+        # constructor does not need to track shared and recursive nodes.
+        self.shared_nodes = bool(self.anchors)
         self.anchors = {}
         return node
 
     def compose_node(self, parent, index):
-        if self.check_event(AliasEvent):
-            event = self.get_event()
-            anchor = event.anchor
-            if anchor not in self.anchors:
-                raise ComposerError(None, None, "found undefined alias %r"
-                        % anchor, event.start_mark)
-            return self.anchors[anchor]
-        event = self.peek_event()
-        anchor = event.anchor
-        if anchor is not None:
-            if anchor in self.anchors:
-                raise ComposerError("found duplicate anchor %r; first occurence"
-                        % anchor, self.anchors[anchor].start_mark,
-                        "second occurence", event.start_mark)
-        self.descend_resolver(parent, index)
-        if self.check_event(ScalarEvent):
-            node = self.compose_scalar_node(anchor)
-        elif self.check_event(SequenceStartEvent):
-            node = self.compose_sequence_node(anchor)
-        elif self.check_event(MappingStartEvent):
-            node = self.compose_mapping_node(anchor)
-        self.ascend_resolver()
-        return node
+        # Collections are composed with an explicit stack instead of
+        # recursion, so deeply nested documents do not hit the recursion
+        # limit. Each entry is a collection node that is still open and,
+        # for a mapping, the key node waiting for its value.
+        stack = []
+        while True:
+            node = None
+            if stack:
+                collection, key = stack[-1]
+                parent = collection
+                if isinstance(collection, SequenceNode):
+                    index = len(collection.value)
+                    end = self.check_event(SequenceEndEvent)
+                else:
+                    index = key
+                    end = key is None and self.check_event(MappingEndEvent)
+                if end:
+                    end_event = self.get_event()
+                    collection.end_mark = end_event.end_mark
+                    self.ascend_resolver()
+                    stack.pop()
+                    node = collection
+            if node is None:
+                if self.check_event(AliasEvent):
+                    event = self.get_event()
+                    anchor = event.anchor
+                    if anchor not in self.anchors:
+                        raise ComposerError(None, None, "found undefined alias %r"
+                                % anchor, event.start_mark)
+                    node = self.anchors[anchor]
+                else:
+                    event = self.peek_event()
+                    anchor = event.anchor
+                    if anchor is not None:
+                        if anchor in self.anchors:
+                            raise ComposerError("found duplicate anchor %r; first occurence"
+                                    % anchor, self.anchors[anchor].start_mark,
+                                    "second occurence", event.start_mark)
+                    self.descend_resolver(parent, index)
+                    if self.check_event(ScalarEvent):
+                        node = self.compose_scalar_node(anchor)
+                        self.ascend_resolver()
+                    elif self.check_event(SequenceStartEvent):
+                        stack.append([self.compose_sequence_node(anchor), None])
+                        continue
+                    elif self.check_event(MappingStartEvent):
+                        stack.append([self.compose_mapping_node(anchor), None])
+                        continue
+            if not stack:
+                return node
+            entry = stack[-1]
+            collection, key = entry
+            if isinstance(collection, SequenceNode):
+                collection.value.append(node)
+            elif key is None:
+                entry[1] = node
+            else:
+                collection.value.append((key, node))
+                entry[1] = None
 
     def compose_scalar_node(self, anchor):
         event = self.get_event()
@@ -97,6 +198,7 @@ class Composer:
         return node
 
     def compose_sequence_node(self, anchor):
+        # Start a sequence node; compose_node fills it in and closes it.
         start_event = self.get_event()
         tag = start_event.tag
         if tag is None or tag == '!':
@@ -106,15 +208,10 @@ class Composer:
                 flow_style=start_event.flow_style)
         if anchor is not None:
             self.anchors[anchor] = node
-        index = 0
-        while not self.check_event(SequenceEndEvent):
-            node.value.append(self.compose_node(node, index))
-            index += 1
-        end_event = self.get_event()
-        node.end_mark = end_event.end_mark
         return node
 
     def compose_mapping_node(self, anchor):
+        # Start a mapping node; compose_node fills it in and closes it.
         start_event = self.get_event()
         tag = start_event.tag
         if tag is None or tag == '!':
@@ -124,16 +221,5 @@ class Composer:
                 flow_style=start_event.flow_style)
         if anchor is not None:
             self.anchors[anchor] = node
-        while not self.check_event(MappingEndEvent):
-            #key_event = self.peek_event()
-            item_key = self.compose_node(node, None)
-            #if item_key in node.value:
-            #    raise ComposerError("while composing a mapping", start_event.start_mark,
-            #            "found duplicate key", key_event.start_mark)
-            item_value = self.compose_node(node, item_key)
-            #node.value[item_key] = item_value
-            node.value.append((item_key, item_value))
-        end_event = self.get_event()
-        node.end_mark = end_event.end_mark
         return node
 
@@ -5,7 +5,7 @@ __all__ = ['BaseConstructor', 'SafeConstructor', 'Constructor',
 from .error import *
 from .nodes import *
 
-import collections, datetime, base64, binascii, re, sys, types
+import collections.abc, datetime, base64, binascii, re, sys, types
 
 class ConstructorError(MarkedYAMLError):
     pass
@@ -20,6 +20,7 @@ class BaseConstructor:
         self.recursive_objects = {}
         self.state_generators = []
         self.deep_construct = False
+        self.shared_nodes = True
 
     def check_data(self):
         # If there are more documents available?
@@ -37,6 +38,19 @@ class BaseConstructor:
             return self.construct_document(node)
         return None
 
+    def get_single_selected_data(self, keys):
+        # Like get_single_data, but only construct the values of the keys
+        # among the strings `keys` if the document is a mapping.
+        node = self.get_single_selected_node(keys)
+        if node is not None:
+            data = self.construct_document(node)
+            if type(data) is dict:
+                # Merge keys may have brought in other keys.
+                data = dict((key, value) for key, value in data.items()
+                            if key in keys)
+            return data
+        return None
+
     def construct_document(self, node):
         data = self.construct_object(node)
         while self.state_generators:
@@ -51,15 +65,17 @@ class BaseConstructor:
         return data
 
     def construct_object(self, node, deep=False):
-        if node in self.constructed_objects:
+        shared_nodes = self.shared_nodes
+        if shared_nodes and node in self.constructed_objects:
             return self.constructed_objects[node]
         if deep:
             old_deep = self.deep_construct
             self.deep_construct = True
-        if node in self.recursive_objects:
-            raise ConstructorError(None, None,
-                    "found unconstructable recursive node", node.start_mark)
-        self.recursive_objects[node] = None
+        if shared_nodes:
+            if node in self.recursive_objects:
+                raise ConstructorError(None, None,
+                        "found unconstructable recursive node", node.start_mark)
+            self.recursive_objects[node] = None
         constructor = None
         tag_suffix = None
         if node.tag in self.yaml_constructors:
@@ -94,8 +110,9 @@ class BaseConstructor:
                     pass
             else:
                 self.state_generators.append(generator)
-        self.constructed_objects[node] = data
-        del self.recursive_objects[node]
+        if shared_nodes:
+            self.constructed_objects[node] = data
+            del self.recursive_objects[node]
         if deep:
             self.deep_construct = old_deep
         return data
@@ -123,7 +140,7 @@ class BaseConstructor:
         mapping = {}
         for key_node, value_node in node.value:
             key = self.construct_object(key_node, deep=deep)
-            if not isinstance(key, collections.Hashable):
+            if not isinstance(key, collections.abc.Hashable):
                 raise ConstructorError("while constructing a mapping", node.start_mark,
                         "found unhashable key", key_node.start_mark)
             value = self.construct_object(value_node, deep=deep)
@@ -41,6 +41,11 @@ class Emitter:
         # The stream should have the methods `write` and possibly `flush`.
         self.stream = stream
 
+        # Output is gathered here and written to the stream in large blocks,
+        # encoded once per block.
+        self.buffer = []
+        self.buffer_size = 0
+
         # Encoding can be overriden by STREAM-START.
         self.encoding = None
 
@@ -104,6 +109,8 @@ class Emitter:
         self.style = None
 
     def dispose(self):
+        # Write out what is left in the buffer.
+        self.flush_buffer()
         # Reset the state attributes (to clear self-references)
         self.states = []
         self.state = None
@@ -784,14 +791,33 @@ class Emitter:
 
     # Writers.
 
+    # The size of the buffer, in characters, that makes it written out.
+    buffer_limit = 65536
+
+    def write_data(self, data):
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.buffer_limit:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if self.buffer:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self.buffer_size = 0
+            if self.encoding:
+                data = data.encode(self.encoding)
+            self.stream.write(data)
+
     def flush_stream(self):
+        self.flush_buffer()
         if hasattr(self.stream, 'flush'):
             self.stream.flush()
 
     def write_stream_start(self):
         # Write BOM if needed.
         if self.encoding and self.encoding.startswith('utf-16'):
-            self.stream.write('\uFEFF'.encode(self.encoding))
+            self.write_data('\uFEFF')
 
     def write_stream_end(self):
         self.flush_stream()
@@ -806,9 +832,7 @@ class Emitter:
         self.indention = self.indention and indention
         self.column += len(data)
         self.open_ended = False
-        if self.encoding:
-            data = data.encode(self.encoding)
-        self.stream.write(data)
+        self.write_data(data)
 
     def write_indent(self):
         indent = self.indent or 0
@@ -819,9 +843,7 @@ class Emitter:
             self.whitespace = True
             data = ' '*(indent-self.column)
             self.column = indent
-            if self.encoding:
-                data = data.encode(self.encoding)
-            self.stream.write(data)
+            self.write_data(data)
 
     def write_line_break(self, data=None):
         if data is None:
@@ -830,22 +852,16 @@ class Emitter:
         self.indention = True
         self.line += 1
         self.column = 0
-        if self.encoding:
-            data = data.encode(self.encoding)
-        self.stream.write(data)
+        self.write_data(data)
 
     def write_version_directive(self, version_text):
         data = '%%YAML %s' % version_text
-        if self.encoding:
-            data = data.encode(self.encoding)
-        self.stream.write(data)
+        self.write_data(data)
         self.write_line_break()
 
     def write_tag_directive(self, handle_text, prefix_text):
         data = '%%TAG %s %s' % (handle_text, prefix_text)
-        if self.encoding:
-            data = data.encode(self.encoding)
-        self.stream.write(data)
+        self.write_data(data)
         self.write_line_break()
 
     # Scalar streams.
@@ -867,9 +883,7 @@ class Emitter:
                     else:
                         data = text[start:end]
                         self.column += len(data)
-                        if self.encoding:
-                            data = data.encode(self.encoding)
-                        self.stream.write(data)
+                        self.write_data(data)
                     start = end
             elif breaks:
                 if ch is None or ch not in '\n\x85\u2028\u2029':
@@ -887,16 +901,12 @@ class Emitter:
                     if start < end:
                         data = text[start:end]
                         self.column += len(data)
-                        if self.encoding:
-                            data = data.encode(self.encoding)
-                        self.stream.write(data)
+                        self.write_data(data)
                         start = end
             if ch == '\'':
                 data = '\'\''
                 self.column += 2
-                if self.encoding:
-                    data = data.encode(self.encoding)
-                self.stream.write(data)
+                self.write_data(data)
                 start = end + 1
             if ch is not None:
                 spaces = (ch == ' ')
@@ -937,9 +947,7 @@ class Emitter:
                 if start < end:
                     data = text[start:end]
                     self.column += len(data)
-                    if self.encoding:
-                        data = data.encode(self.encoding)
-                    self.stream.write(data)
+                    self.write_data(data)
                     start = end
                 if ch is not None:
                     if ch in self.ESCAPE_REPLACEMENTS:
@@ -951,9 +959,7 @@ class Emitter:
                     else:
                         data = '\\U%08X' % ord(ch)
                     self.column += len(data)
-                    if self.encoding:
-                        data = data.encode(self.encoding)
-                    self.stream.write(data)
+                    self.write_data(data)
                     start = end+1
             if 0 < end < len(text)-1 and (ch == ' ' or start >= end)    \
                     and self.column+(end-start) > self.best_width and split:
@@ -961,18 +967,14 @@ class Emitter:
                 if start < end:
                     start = end
                 self.column += len(data)
-                if self.encoding:
-                    data = data.encode(self.encoding)
-                self.stream.write(data)
+                self.write_data(data)
                 self.write_indent()
                 self.whitespace = False
                 self.indention = False
                 if text[start] == ' ':
                     data = '\\'
                     self.column += len(data)
-                    if self.encoding:
-                        data = data.encode(self.encoding)
-                    self.stream.write(data)
+                    self.write_data(data)
             end += 1
         self.write_indicator('"', False)
 
@@ -1022,17 +1024,13 @@ class Emitter:
                     else:
                         data = text[start:end]
                         self.column += len(data)
-                        if self.encoding:
-                            data = data.encode(self.encoding)
-                        self.stream.write(data)
+                        self.write_data(data)
                     start = end
             else:
                 if ch is None or ch in ' \n\x85\u2028\u2029':
                     data = text[start:end]
                     self.column += len(data)
-                    if self.encoding:
-                        data = data.encode(self.encoding)
-                    self.stream.write(data)
+                    self.write_data(data)
                     if ch is None:
                         self.write_line_break()
                     start = end
@@ -1066,9 +1064,7 @@ class Emitter:
             else:
                 if ch is None or ch in '\n\x85\u2028\u2029':
                     data = text[start:end]
-                    if self.encoding:
-                        data = data.encode(self.encoding)
-                    self.stream.write(data)
+                    self.write_data(data)
                     if ch is None:
                         self.write_line_break()
                     start = end
@@ -1084,9 +1080,7 @@ class Emitter:
         if not self.whitespace:
             data = ' '
             self.column += len(data)
-            if self.encoding:
-                data = data.encode(self.encoding)
-            self.stream.write(data)
+            self.write_data(data)
         self.whitespace = False
         self.indention = False
         spaces = False
@@ -1105,9 +1099,7 @@ class Emitter:
                     else:
                         data = text[start:end]
                         self.column += len(data)
-                        if self.encoding:
-                            data = data.encode(self.encoding)
-                        self.stream.write(data)
+                        self.write_data(data)
                     start = end
             elif breaks:
                 if ch not in '\n\x85\u2028\u2029':
@@ -1126,9 +1118,7 @@ class Emitter:
                 if ch is None or ch in ' \n\x85\u2028\u2029':
                     data = text[start:end]
                     self.column += len(data)
-                    if self.encoding:
-                        data = data.encode(self.encoding)
-                    self.stream.write(data)
+                    self.write_data(data)
                     start = end
             if ch is not None:
                 spaces = (ch == ' ')
@@ -1,8 +1,12 @@
 
-__all__ = ['Mark', 'YAMLError', 'MarkedYAMLError']
+__all__ = ['Mark', 'LazyMark', 'MarkSource', 'YAMLError', 'MarkedYAMLError']
+
+import array, bisect
 
 class Mark:
 
+    __slots__ = ('name', 'index', 'line', 'column', 'buffer', 'pointer')
+
     def __init__(self, name, index, line, column, buffer, pointer):
         self.name = name
         self.index = index
@@ -42,6 +46,63 @@ class Mark:
             where += ":\n"+snippet
         return where
 
+class MarkSource:
+    # The line starts of a stream (and the positions of BOMs, which take no
+    # column), recorded by the Reader so that a LazyMark can work out the
+    # line and the column of its index. `buffer` is the whole decoded
+    # stream if it is kept in memory, otherwise None.
+
+    def __init__(self, name):
+        self.name = name
+        self.buffer = None
+        self.line_starts = array.array('l', [0])
+        self.boms = []
+
+    def locate(self, index):
+        line = bisect.bisect_right(self.line_starts, index)-1
+        start = self.line_starts[line]
+        column = index-start
+        if self.boms:
+            column -= bisect.bisect_left(self.boms, index)  \
+                    - bisect.bisect_left(self.boms, start)
+        return line, column
+
+class LazyMark(Mark):
+    # A Mark that only records its index. The line, the column and the
+    # snippet are worked out from the MarkSource when they are needed,
+    # which is usually only when an error is formatted.
+
+    # `index` is a slot of Mark, the other fields of Mark are properties.
+    __slots__ = ('source',)
+
+    def __init__(self, source, index):
+        self.source = source
+        self.index = index
+
+    def __reduce__(self):
+        # The slots of Mark other than `index` are read-only properties.
+        return (LazyMark, (self.source, self.index))
+
+    @property
+    def name(self):
+        return self.source.name
+
+    @property
+    def line(self):
+        return self.source.locate(self.index)[0]
+
+    @property
+    def column(self):
+        return self.source.locate(self.index)[1]
+
+    @property
+    def buffer(self):
+        return self.source.buffer
+
+    @property
+    def pointer(self):
+        return self.index
+
 class YAMLError(Exception):
     pass
 
@@ -0,0 +1,122 @@
+
+# FlatDumper writes the kind of data found in settings and variables blocks
+# without going through the Serializer and the Emitter:
+#
+#   key: plain scalar
+#   quoted: 'needs quotes: yes'
+#   escaped: "line\nbreak"
+#   list: [a, 'b, c', 1, true]
+#   empty: null
+#
+# The data must be a non-empty dict with str keys, whose values are None,
+# bools, ints, floats, strs or lists of those. Scalars are represented with
+# Representer and styled with the same analysis as the Emitter, but are
+# always written on a single line, so the output loads to the same data as
+# that of `dump`. Anything else raises FlatDumperFallback, and the caller
+# should dump the data with the full Dumper instead.
+
+__all__ = ['FlatDumper', 'FlatDumperFallback']
+
+from .error import YAMLError
+from .emitter import Emitter
+from .nodes import ScalarNode
+from .representer import Representer
+from .resolver import Resolver
+
+class FlatDumperFallback(YAMLError):
+    pass
+
+class FlatDumper(Representer, Resolver):
+
+    SCALAR_TYPES = (type(None), bool, int, float, str)
+
+    # Keys longer than this are written as complex keys by the Emitter.
+    MAX_KEY_LENGTH = 128
+
+    # Formatted scalars by (type, value, context), shared by all dumpers
+    # since the same values are usually dumped over and over again.
+    scalar_cache = {}
+    scalar_cache_size = 4096
+
+    analyze_scalar = Emitter.analyze_scalar
+    ESCAPE_REPLACEMENTS = Emitter.ESCAPE_REPLACEMENTS
+
+    def __init__(self):
+        Representer.__init__(self)
+        Resolver.__init__(self)
+        self.allow_unicode = None
+
+    def dump(self, data):
+        if type(data) is not dict or not data:
+            raise FlatDumperFallback()
+        try:
+            keys = sorted(data)
+        except TypeError:
+            raise FlatDumperFallback()
+        lines = []
+        for key in keys:
+            if type(key) is not str or len(key) >= self.MAX_KEY_LENGTH:
+                raise FlatDumperFallback()
+            value = data[key]
+            if type(value) is list:
+                value = '['+', '.join([self.format_scalar(item, 'flow')
+                        for item in value])+']'
+            else:
+                value = self.format_scalar(value, 'block')
+            lines.append(self.format_scalar(key, 'key')+': '+value+'\n')
+        return ''.join(lines)
+
+    def format_scalar(self, value, context):
+        # `context` is 'key' for mapping keys, 'block' for mapping values
+        # and 'flow' for sequence items.
+        if type(value) not in self.SCALAR_TYPES:
+            raise FlatDumperFallback()
+        if type(value) is float:
+            # 0.0 == -0.0 and nan != nan, so floats are keyed by their repr.
+            cache_key = (float, repr(value), context)
+        else:
+            cache_key = (type(value), value, context)
+        try:
+            return self.scalar_cache[cache_key]
+        except KeyError:
+            pass
+        node = self.represent_data(value)
+        text = node.value
+        analysis = self.analyze_scalar(text)
+        if context == 'flow':
+            allow_plain = analysis.allow_flow_plain
+        elif context == 'key':
+            allow_plain = analysis.allow_block_plain  \
+                    and not (analysis.empty or analysis.multiline)
+        else:
+            allow_plain = analysis.allow_block_plain
+        if allow_plain and node.tag == self.resolve(ScalarNode, text, (True, False)):
+            result = text
+        elif node.tag != self.resolve(ScalarNode, text, (False, True)):
+            # The scalar would need an explicit tag.
+            raise FlatDumperFallback()
+        elif analysis.allow_single_quoted and not analysis.multiline:
+            result = '\''+text.replace('\'', '\'\'')+'\''
+        else:
+            result = self.format_double_quoted(text)
+        if len(self.scalar_cache) >= self.scalar_cache_size:
+            self.scalar_cache.clear()
+        self.scalar_cache[cache_key] = result
+        return result
+
+    def format_double_quoted(self, text):
+        chunks = ['"']
+        for ch in text:
+            if ch in '"\\\x85\u2028\u2029\uFEFF' or not '\x20' <= ch <= '\x7E':
+                if ch in self.ESCAPE_REPLACEMENTS:
+                    ch = '\\'+self.ESCAPE_REPLACEMENTS[ch]
+                elif ch <= '\xFF':
+                    ch = '\\x%02X' % ord(ch)
+                elif ch <= '\uFFFF':
+                    ch = '\\u%04X' % ord(ch)
+                else:
+                    ch = '\\U%08X' % ord(ch)
+            chunks.append(ch)
+        chunks.append('"')
+        return ''.join(chunks)
+
@@ -0,0 +1,196 @@
+
+# FlatLoader loads the kind of YAML found in front matter and settings files
+# without going through the Reader, Scanner, Parser and Composer:
+#
+#   # comment
+#   key: plain scalar            # comment
+#   quoted: 'single quoted'
+#   list: [a, 'b', 1, true]
+#   nested:
+#       key: value
+#   empty:
+#
+# Keys are plain words, values are plain or quoted scalars on a single line,
+# flow sequences of scalars (possibly spanning several lines), nested block
+# mappings or nothing at all. Scalars are resolved and constructed exactly as
+# SafeLoader does. Anything else raises FlatLoaderFallback, and the caller
+# should load the document with the full SafeLoader instead.
+
+__all__ = ['FlatLoader', 'FlatLoaderFallback']
+
+from .error import YAMLError
+from .nodes import ScalarNode
+from .constructor import SafeConstructor
+from .resolver import Resolver
+
+import re
+
+class FlatLoaderFallback(YAMLError):
+    pass
+
+class FlatLoader(SafeConstructor, Resolver):
+
+    # Characters that make the document fall outside of the subset, either
+    # because they need special treatment (tabs, other line breaks, BOM) or
+    # because they are not allowed in YAML at all.
+    UNSUPPORTED = re.compile('[^\x0A\x20-\x7E\xA0-\u2027\u202A-\uD7FF\uE000-\uFEFE\uFF00-\uFFFD]')
+
+    KEY = re.compile(r'([A-Za-z0-9_][A-Za-z0-9_.-]*) *:(?: +|$)')
+
+    # Characters that cannot start a plain scalar in this subset.
+    PLAIN_INDICATORS = '[]{}#&*!|>\'"%@`,?:'
+
+    # Characters that cannot appear in a plain scalar in a flow sequence.
+    FLOW_INDICATORS = re.compile('[\\[\\]{},:]')
+
+    def __init__(self):
+        SafeConstructor.__init__(self)
+        Resolver.__init__(self)
+
+    def load(self, text):
+        if self.UNSUPPORTED.search(text):
+            raise FlatLoaderFallback()
+        lines = text.split('\n')
+        data = None
+        # Stack of (indent, mapping) of the open block mappings.
+        stack = []
+        # Key whose value is still undecided: null or a nested mapping.
+        pending = None
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            index += 1
+            stripped = line.lstrip(' ')
+            if not stripped or stripped.startswith('#'):
+                continue
+            indent = len(line)-len(stripped)
+            if data is None:
+                if indent:
+                    raise FlatLoaderFallback()
+                data = {}
+                stack.append((0, data))
+            if pending is not None:
+                parent, key, key_indent = pending
+                pending = None
+                if indent > key_indent:
+                    mapping = {}
+                    parent[key] = mapping
+                    stack.append((indent, mapping))
+                else:
+                    parent[key] = self.construct_plain('')
+            while indent < stack[-1][0]:
+                stack.pop()
+            if indent != stack[-1][0]:
+                raise FlatLoaderFallback()
+            mapping = stack[-1][1]
+            match = self.KEY.match(stripped)
+            if not match:
+                raise FlatLoaderFallback()
+            if match.end() > 1024:
+                # Simple keys are limited to 1024 characters.
+                raise FlatLoaderFallback()
+            key = self.construct_plain(match.group(1))
+            rest = stripped[match.end():]
+            if not rest or rest.startswith('#'):
+                pending = (mapping, key, indent)
+                continue
+            if rest.startswith('['):
+                value, index = self.scan_flow_sequence(lines, index, rest)
+            elif rest.startswith('\''):
+                value, rest = self.scan_single_quoted(rest)
+                self.check_line_end(rest)
+            else:
+                value = self.scan_plain(rest)
+            # A more indented line after a scalar would continue it.
+            following = index
+            while following < len(lines):
+                line = lines[following]
+                stripped = line.lstrip(' ')
+                if stripped:
+                    if len(line)-len(stripped) > indent:
+                        raise FlatLoaderFallback()
+                    break
+                following += 1
+            mapping[key] = value
+        if pending is not None:
+            parent, key, key_indent = pending
+            parent[key] = self.construct_plain('')
+        return data
+
+    def check_line_end(self, rest):
+        rest = rest.lstrip(' ')
+        if rest and not rest.startswith('#'):
+            raise FlatLoaderFallback()
+
+    def scan_plain(self, text, flow=False):
+        if text[0] in self.PLAIN_INDICATORS  \
+                or (text[0] == '-' and text[1:2] in ['', ' ']):
+            raise FlatLoaderFallback()
+        end = text.find(' #')
+        if end != -1:
+            text = text[:end]
+        text = text.rstrip(' ')
+        if ': ' in text or text.endswith(':'):
+            raise FlatLoaderFallback()
+        if flow and self.FLOW_INDICATORS.search(text):
+            raise FlatLoaderFallback()
+        return self.construct_plain(text)
+
+    def scan_single_quoted(self, text):
+        # Return the value and the remainder of the line after the quote.
+        chunks = []
+        start = 1
+        while True:
+            end = text.find('\'', start)
+            if end == -1:
+                raise FlatLoaderFallback()
+            chunks.append(text[start:end])
+            if text[end+1:end+2] == '\'':
+                chunks.append('\'')
+                start = end+2
+            else:
+                return ''.join(chunks), text[end+1:]
+
+    def scan_flow_sequence(self, lines, index, text):
+        # Return the list and the index of the line following it.
+        items = []
+        text = text[1:]
+        while True:
+            text = text.lstrip(' ')
+            if not text:
+                # The sequence continues on the next line.
+                if index >= len(lines):
+                    raise FlatLoaderFallback()
+                text = lines[index]
+                index += 1
+                continue
+            if text.startswith(']'):
+                self.check_line_end(text[1:])
+                return items, index
+            if text.startswith('\''):
+                item, text = self.scan_single_quoted(text)
+            else:
+                end = len(text)
+                for indicator in ',]':
+                    position = text.find(indicator)
+                    if position != -1 and position < end:
+                        end = position
+                item = text[:end].rstrip(' ')
+                if not item or ' #' in item:
+                    raise FlatLoaderFallback()
+                item = self.scan_plain(item, flow=True)
+                text = text[end:]
+            items.append(item)
+            text = text.lstrip(' ')
+            if text.startswith(','):
+                text = text[1:]
+            elif not text.startswith(']'):
+                # Items split over lines, comments, nested collections.
+                raise FlatLoaderFallback()
+
+    def construct_plain(self, value):
+        tag = self.resolve(ScalarNode, value, (True, False))
+        if tag not in self.yaml_constructors:
+            raise FlatLoaderFallback()
+        return self.yaml_constructors[tag](self, ScalarNode(tag, value))
+
@@ -17,9 +17,9 @@
 
 __all__ = ['Reader', 'ReaderError']
 
-from .error import YAMLError, Mark
+from .error import YAMLError, LazyMark, MarkSource
 
-import codecs, re
+import codecs, io, mmap, os, re
 
 class ReaderError(YAMLError):
 
@@ -50,9 +50,11 @@ class Reader(object):
 
     # Reader accepts
     #  - a `bytes` object,
+    #  - an `mmap.mmap` object,
     #  - a `str` object,
     #  - a file-like object with its `read` method returning `str`,
     #  - a file-like object with its `read` method returning `unicode`.
+    # Files opened in binary mode are mapped into memory and decoded at once.
 
     # Yeah, it's ugly and slow.
 
@@ -71,18 +73,25 @@ class Reader(object):
         self.column = 0
         if isinstance(stream, str):
             self.name = "<unicode string>"
+            self.mark_source = MarkSource(self.name)
             self.check_printable(stream)
             self.buffer = stream+'\0'
-        elif isinstance(stream, bytes):
+        elif isinstance(stream, (bytes, mmap.mmap)):
             self.name = "<byte string>"
+            self.mark_source = MarkSource(self.name)
             self.raw_buffer = stream
             self.determine_encoding()
         else:
             self.stream = stream
             self.name = getattr(stream, 'name', "<file>")
+            self.mark_source = MarkSource(self.name)
             self.eof = False
             self.raw_buffer = None
-            self.determine_encoding()
+            if not self.map_stream():
+                self.determine_encoding()
+        if self.stream is None:
+            # The whole stream is in the buffer, so marks can show snippets.
+            self.mark_source.buffer = self.buffer
 
     def peek(self, index=0):
         try:
@@ -96,9 +105,34 @@ class Reader(object):
             self.update(length)
         return self.buffer[self.pointer:self.pointer+length]
 
+    # Characters that need the character by character treatment in `forward`:
+    # line breaks other than '\n', and the BOM which takes no column.
+    SPECIAL_BREAKS = re.compile('[\r\x85\u2028\u2029\uFEFF]')
+
     def forward(self, length=1):
         if self.pointer+length+1 >= len(self.buffer):
             self.update(length+1)
+        if length > 1 and not self.SPECIAL_BREAKS.search(self.buffer,
+                self.pointer, self.pointer+length):
+            # Advance over the whole slice at once, counting the '\n' line
+            # breaks in it to update the line and column.
+            end = self.pointer+length
+            breaks = self.buffer.count('\n', self.pointer, end)
+            if breaks:
+                self.line += breaks
+                line_starts = self.mark_source.line_starts
+                offset = self.index-self.pointer+1
+                position = self.buffer.find('\n', self.pointer, end)
+                while position != -1:
+                    line_starts.append(position+offset)
+                    last = position
+                    position = self.buffer.find('\n', position+1, end)
+                self.column = end-last-1
+            else:
+                self.column += length
+            self.pointer = end
+            self.index += length
+            return
         while length:
             ch = self.buffer[self.pointer]
             self.pointer += 1
@@ -107,26 +141,26 @@ class Reader(object):
                     or (ch == '\r' and self.buffer[self.pointer] != '\n'):
                 self.line += 1
                 self.column = 0
+                self.mark_source.line_starts.append(self.index)
             elif ch != '\uFEFF':
                 self.column += 1
+            else:
+                self.mark_source.boms.append(self.index-1)
             length -= 1
 
     def get_mark(self):
-        if self.stream is None:
-            return Mark(self.name, self.index, self.line, self.column,
-                    self.buffer, self.pointer)
-        else:
-            return Mark(self.name, self.index, self.line, self.column,
-                    None, None)
+        # Marks are only needed for error messages, so record just the
+        # index and let the mark work out the rest when it is formatted.
+        return LazyMark(self.mark_source, self.index)
 
     def determine_encoding(self):
         while not self.eof and (self.raw_buffer is None or len(self.raw_buffer) < 2):
             self.update_raw()
-        if isinstance(self.raw_buffer, bytes):
-            if self.raw_buffer.startswith(codecs.BOM_UTF16_LE):
+        if isinstance(self.raw_buffer, (bytes, mmap.mmap)):
+            if self.raw_buffer[:2] == codecs.BOM_UTF16_LE:
                 self.raw_decode = codecs.utf_16_le_decode
                 self.encoding = 'utf-16-le'
-            elif self.raw_buffer.startswith(codecs.BOM_UTF16_BE):
+            elif self.raw_buffer[:2] == codecs.BOM_UTF16_BE:
                 self.raw_decode = codecs.utf_16_be_decode
                 self.encoding = 'utf-16-be'
             else:
@@ -134,6 +168,31 @@ class Reader(object):
                 self.encoding = 'utf-8'
         self.update(1)
 
+    def map_stream(self):
+        # Map a regular file opened in binary mode into memory and decode it
+        # in one step, as if it was a byte string. Return False for other
+        # streams and for files that fit in a single read, which are read
+        # in chunks.
+        if not isinstance(self.stream, (io.BufferedReader, io.FileIO)):
+            return False
+        try:
+            if self.stream.tell() != 0  \
+                    or os.fstat(self.stream.fileno()).st_size <= self.read_size:
+                return False
+            mapped = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files, pipes and the like cannot be mapped.
+            return False
+        try:
+            self.raw_buffer = mapped
+            self.stream_pointer = len(mapped)
+            self.eof = True
+            self.determine_encoding()
+        finally:
+            mapped.close()
+        self.stream.seek(0, io.SEEK_END)
+        return True
+
     NON_PRINTABLE = re.compile('[^\x09\x0A\x0D\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD]')
     def check_printable(self, data):
         match = self.NON_PRINTABLE.search(data)
@@ -143,12 +202,18 @@ class Reader(object):
             raise ReaderError(self.name, position, ord(character),
                     'unicode', "special characters are not allowed")
 
+    # The number of bytes (or characters) read from a stream at a time.
+    read_size = 65536
+
     def update(self, length):
         if self.raw_buffer is None:
             return
-        self.buffer = self.buffer[self.pointer:]
-        self.pointer = 0
-        while len(self.buffer) < length:
+        # Decode all the data needed first, then check it and join it to the
+        # unread part of the buffer at once, so that a refill copies the
+        # buffer only once however many reads it takes.
+        chunks = []
+        size = len(self.buffer)-self.pointer
+        while size < length:
             if not self.eof:
                 self.update_raw()
             if self.raw_decode is not None:
@@ -156,6 +221,7 @@ class Reader(object):
                     data, converted = self.raw_decode(self.raw_buffer,
                             'strict', self.eof)
                 except UnicodeDecodeError as exc:
+                    self.check_printable(''.join(chunks))
                     character = self.raw_buffer[exc.start]
                     if self.stream is not None:
                         position = self.stream_pointer-len(self.raw_buffer)+exc.start
@@ -166,15 +232,27 @@ class Reader(object):
             else:
                 data = self.raw_buffer
                 converted = len(data)
-            self.check_printable(data)
-            self.buffer += data
+            chunks.append(data)
+            size += len(data)
             self.raw_buffer = self.raw_buffer[converted:]
             if self.eof:
-                self.buffer += '\0'
                 self.raw_buffer = None
                 break
+        if not chunks:
+            return
+        data = ''.join(chunks)
+        self.check_printable(data)
+        if self.raw_buffer is None:
+            data += '\0'
+        if self.pointer:
+            self.buffer = self.buffer[self.pointer:]+data
+            self.pointer = 0
+        else:
+            self.buffer += data
 
-    def update_raw(self, size=4096):
+    def update_raw(self, size=None):
+        if size is None:
+            size = self.read_size
         data = self.stream.read(size)
         if self.raw_buffer is None:
             self.raw_buffer = data
@@ -4,6 +4,7 @@ __all__ = ['BaseRepresenter', 'SafeRepresenter', 'Representer',
 
 from .error import *
 from .nodes import *
+from .events import *
 
 import datetime, sys, copyreg, types, base64
 
@@ -23,12 +24,138 @@ class BaseRepresenter:
         self.alias_key = None
 
     def represent(self, data):
+        # Nodes are only shared if an object is represented twice, which
+        # represent_data notes for the serializer.
+        self.shared_nodes = False
         node = self.represent_data(data)
         self.serialize(node)
         self.represented_objects = {}
         self.object_keeper = []
         self.alias_key = None
 
+    def represent_incrementally(self, data):
+        # Emit a document for `data` while walking it, instead of building
+        # its whole representation tree first. Dicts, lists and generators
+        # are emitted item by item; other objects are represented and
+        # serialized one at a time. Objects that appear more than once are
+        # written out again rather than aliased.
+        if self.closed is None:
+            raise RepresenterError("serializer is not opened")
+        elif self.closed:
+            raise RepresenterError("serializer is closed")
+        self.emit(DocumentStartEvent(explicit=self.use_explicit_start,
+            version=self.use_version, tags=self.use_tags))
+        self.shared_nodes = True
+        self.incremental_objects = set()
+        self.represent_object_incrementally(data, None, None)
+        self.emit(DocumentEndEvent(explicit=self.use_explicit_end))
+        self.incremental_objects = None
+        self.represented_objects = {}
+        self.object_keeper = []
+        self.alias_key = None
+        self.last_anchor_id = 0
+
+    def is_incremental(self, data):
+        # Whether `data` is walked by represent_object_incrementally.
+        if isinstance(data, types.GeneratorType):
+            return True
+        representer = self.yaml_representers.get(type(data))
+        return representer is SafeRepresenter.represent_list  \
+                or representer is SafeRepresenter.represent_dict
+
+    def represent_child(self, data):
+        # Represent an object that is not walked incrementally on its own,
+        # so that its nodes can be dropped once it is serialized.
+        if self.is_incremental(data):
+            return None
+        self.represented_objects = {}
+        self.object_keeper = []
+        return self.represent_data(data)
+
+    def serialize_child(self, data, node, parent, index):
+        if node is None:
+            self.represent_object_incrementally(data, parent, index)
+        else:
+            self.anchor_node(node)
+            self.serialize_node(node, parent, index)
+            self.anchors = {}
+            self.serialized_nodes = {}
+
+    def represent_object_incrementally(self, data, parent, index):
+        if not self.is_incremental(data):
+            self.serialize_child(data, self.represent_child(data), parent, index)
+            return
+        if id(data) in self.incremental_objects:
+            raise RepresenterError("cannot represent a recursive object "
+                    "incrementally: %r" % data)
+        self.incremental_objects.add(id(data))
+        self.descend_resolver(parent, index)
+        if isinstance(data, types.GeneratorType):
+            # The items are not known in advance, so the best style cannot
+            # be worked out.
+            flow_style = self.default_flow_style
+            if flow_style is None:
+                flow_style = False
+            node = SequenceNode('tag:yaml.org,2002:seq', [])
+            implicit = (node.tag == self.resolve(SequenceNode, None, True))
+            self.emit(SequenceStartEvent(None, node.tag, implicit,
+                flow_style=flow_style))
+            index = 0
+            for item in data:
+                self.serialize_child(item, self.represent_child(item),
+                        node, index)
+                index += 1
+            self.emit(SequenceEndEvent())
+        elif isinstance(data, dict):
+            node = MappingNode('tag:yaml.org,2002:map', [])
+            mapping = list(data.items())
+            try:
+                mapping = sorted(mapping)
+            except TypeError:
+                pass
+            best_style = True
+            children = []
+            for item_key, item_value in mapping:
+                node_key = self.represent_child(item_key)
+                node_value = self.represent_child(item_value)
+                if not (isinstance(node_key, ScalarNode) and not node_key.style):
+                    best_style = False
+                if not (isinstance(node_value, ScalarNode) and not node_value.style):
+                    best_style = False
+                children.append((item_key, node_key, item_value, node_value))
+            flow_style = self.default_flow_style
+            if flow_style is None:
+                flow_style = best_style
+            implicit = (node.tag == self.resolve(MappingNode, None, True))
+            self.emit(MappingStartEvent(None, node.tag, implicit,
+                flow_style=flow_style))
+            for item_key, node_key, item_value, node_value in children:
+                self.serialize_child(item_key, node_key, node, None)
+                self.serialize_child(item_value, node_value, node, node_key)
+            self.emit(MappingEndEvent())
+        else:
+            node = SequenceNode('tag:yaml.org,2002:seq', [])
+            best_style = True
+            children = []
+            for item in data:
+                node_item = self.represent_child(item)
+                if not (isinstance(node_item, ScalarNode) and not node_item.style):
+                    best_style = False
+                children.append((item, node_item))
+            flow_style = self.default_flow_style
+            if flow_style is None:
+                flow_style = best_style
+            implicit = (node.tag == self.resolve(SequenceNode, None, True))
+            self.emit(SequenceStartEvent(None, node.tag, implicit,
+                flow_style=flow_style))
+            index = 0
+            for item, node_item in children:
+                self.serialize_child(item, node_item, node, index)
+                index += 1
+            self.emit(SequenceEndEvent())
+        self.ascend_resolver()
+        self.incremental_objects.remove(id(data))
+
     def represent_data(self, data):
         if self.ignore_aliases(data):
             self.alias_key = None
@@ -37,6 +164,7 @@ class BaseRepresenter:
         if self.alias_key is not None:
             if self.alias_key in self.represented_objects:
                 node = self.represented_objects[self.alias_key]
+                self.shared_nodes = True
                 #if node is None:
                 #    raise RepresenterError("recursive objects are not allowed: %r" % data)
                 return node
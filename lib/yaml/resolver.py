@@ -16,6 +16,7 @@ class BaseResolver:
     DEFAULT_MAPPING_TAG = 'tag:yaml.org,2002:map'
 
     yaml_implicit_resolvers = {}
+    yaml_implicit_resolvers_compiled = {}
     yaml_path_resolvers = {}
 
     def __init__(self):
@@ -25,11 +26,49 @@ class BaseResolver:
     @classmethod
     def add_implicit_resolver(cls, tag, regexp, first):
         if not 'yaml_implicit_resolvers' in cls.__dict__:
-            cls.yaml_implicit_resolvers = cls.yaml_implicit_resolvers.copy()
+            # Copy the lists too, so that the resolvers of the base class
+            # (and its compiled resolvers) are left alone.
+            cls.yaml_implicit_resolvers = dict((ch, list(resolvers))
+                    for ch, resolvers in cls.yaml_implicit_resolvers.items())
         if first is None:
             first = [None]
         for ch in first:
             cls.yaml_implicit_resolvers.setdefault(ch, []).append((tag, regexp))
+        cls.yaml_implicit_resolvers_compiled = {}
+
+    @classmethod
+    def compile_implicit_resolvers(cls, ch):
+        # Combine the resolvers for scalars starting with `ch` (and those
+        # for any first character) into as few regexps as possible. Runs of
+        # consecutive regexps with the same flags and without groups of
+        # their own are joined into one alternation; the index of the
+        # matching group then gives the tag. The alternatives keep their
+        # order, so the first matching resolver still wins.
+        resolvers = cls.yaml_implicit_resolvers.get(ch, [])  \
+                + cls.yaml_implicit_resolvers.get(None, [])
+        compiled = []
+        run = []
+        for tag, regexp in resolvers + [(None, None)]:
+            if run and (regexp is None or regexp.groups
+                    or regexp.flags != run[0][1].flags):
+                if len(run) == 1:
+                    compiled.append((run[0][1], run[0][0]))
+                else:
+                    flags = run[0][1].flags
+                    end = '\n)' if flags & re.X else ')'
+                    pattern = '|'.join(['('+regexp.pattern+end
+                            for tag, regexp in run])
+                    tags = tuple([tag for tag, regexp in run])
+                    compiled.append((re.compile(pattern, flags), tags))
+                run = []
+            if regexp is None:
+                break
+            if regexp.groups:
+                compiled.append((regexp, tag))
+            else:
+                run.append((tag, regexp))
+        cls.yaml_implicit_resolvers_compiled[ch] = compiled
+        return compiled
 
     @classmethod
     def add_path_resolver(cls, tag, path, kind=None):
@@ -140,12 +179,18 @@ class BaseResolver:
     def resolve(self, kind, value, implicit):
         if kind is ScalarNode and implicit[0]:
             if value == '':
-                resolvers = self.yaml_implicit_resolvers.get('', [])
+                ch = ''
             else:
-                resolvers = self.yaml_implicit_resolvers.get(value[0], [])
-            resolvers += self.yaml_implicit_resolvers.get(None, [])
-            for tag, regexp in resolvers:
-                if regexp.match(value):
+                ch = value[0]
+            try:
+                resolvers = self.yaml_implicit_resolvers_compiled[ch]
+            except KeyError:
+                resolvers = self.compile_implicit_resolvers(ch)
+            for regexp, tag in resolvers:
+                match = regexp.match(value)
+                if match:
+                    if isinstance(tag, tuple):
+                        return tag[match.lastindex-1]
                     return tag
             implicit = implicit[1]
         if self.yaml_path_resolvers:
@@ -29,6 +29,8 @@ __all__ = ['Scanner', 'ScannerError']
 from .error import MarkedYAMLError
 from .tokens import *
 
+import collections
+
 class ScannerError(MarkedYAMLError):
     pass
 
@@ -63,8 +65,8 @@ class Scanner:
         # context.
         self.flow_level = 0
 
-        # List of processed tokens that are not yet emitted.
-        self.tokens = []
+        # Queue of processed tokens that are not yet emitted.
+        self.tokens = collections.deque()
 
         # Add the STREAM-START token.
         self.fetch_stream_start()
@@ -108,6 +110,10 @@ class Scanner:
         # '[', or '{' tokens.
         self.possible_simple_keys = {}
 
+        # The position at which possible simple keys were last checked for
+        # staleness. Keys can only go stale when the position changes.
+        self.possible_simple_keys_index = -1
+
     # Public methods.
 
     def check_token(self, *choices):
@@ -135,7 +141,7 @@ class Scanner:
             self.fetch_more_tokens()
         if self.tokens:
             self.tokens_taken += 1
-            return self.tokens.pop(0)
+            return self.tokens.popleft()
 
     # Private methods.
 
@@ -146,9 +152,11 @@ class Scanner:
             return True
         # The current token may be a potential simple key, so we
         # need to look further.
-        self.stale_possible_simple_keys()
-        if self.next_possible_simple_key() == self.tokens_taken:
-            return True
+        if self.possible_simple_keys:
+            self.stale_possible_simple_keys()
+            if self.next_possible_simple_key() == self.tokens_taken:
+                return True
+        return False
 
     def fetch_more_tokens(self):
 
@@ -280,6 +288,9 @@ class Scanner:
         # - should be no longer than 1024 characters.
         # Disabling this procedure will allow simple keys of any length and
         # height (may cause problems if indentation is broken though).
+        if self.index == self.possible_simple_keys_index:
+            return
+        self.possible_simple_keys_index = self.index
         for level in list(self.possible_simple_keys):
             key = self.possible_simple_keys[level]
             if key.line != self.line  \
@@ -321,6 +332,13 @@ class Scanner:
 
             del self.possible_simple_keys[self.flow_level]
 
+    def insert_token(self, index, token):
+        # Insert a token into the queue; `deque.insert` is not available
+        # before Python 3.5.
+        self.tokens.rotate(-index)
+        self.tokens.appendleft(token)
+        self.tokens.rotate(index)
+
     # Indentation functions.
 
     def unwind_indent(self, column):
@@ -551,14 +569,14 @@ class Scanner:
             # Add KEY.
             key = self.possible_simple_keys[self.flow_level]
             del self.possible_simple_keys[self.flow_level]
-            self.tokens.insert(key.token_number-self.tokens_taken,
+            self.insert_token(key.token_number-self.tokens_taken,
                     KeyToken(key.mark, key.mark))
 
             # If this key starts a new block mapping, we need to add
             # BLOCK-MAPPING-START.
             if not self.flow_level:
                 if self.add_indent(key.column):
-                    self.tokens.insert(key.token_number-self.tokens_taken,
+                    self.insert_token(key.token_number-self.tokens_taken,
                             BlockMappingStartToken(key.mark, key.mark))
 
             # There cannot be two simple keys one after another.
@@ -774,11 +792,14 @@ class Scanner:
             self.forward()
         found = False
         while not found:
-            while self.peek() == ' ':
-                self.forward()
-            if self.peek() == '#':
-                while self.peek() not in '\0\r\n\x85\u2028\u2029':
-                    self.forward()
+            length = 0
+            while self.peek(length) == ' ':
+                length += 1
+            if self.peek(length) == '#':
+                while self.peek(length) not in '\0\r\n\x85\u2028\u2029':
+                    length += 1
+            if length:
+                self.forward(length)
             if self.scan_line_break():
                 if not self.flow_level:
                     self.allow_simple_key = True
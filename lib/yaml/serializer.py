@@ -12,6 +12,9 @@ class Serializer:
 
     ANCHOR_TEMPLATE = 'id%03d'
 
+    # The number of scalars whose implicit flags are remembered.
+    implicit_scalars_size = 4096
+
     def __init__(self, encoding=None,
             explicit_start=None, explicit_end=None, version=None, tags=None):
         self.use_encoding = encoding
@@ -23,6 +26,11 @@ class Serializer:
         self.anchors = {}
         self.last_anchor_id = 0
         self.closed = None
+        # Whether nodes may be shared or recursive. Representer clears it
+        # for documents where no object was represented twice.
+        self.shared_nodes = True
+        # Implicit flags of scalars by (value, tag).
+        self.implicit_scalars = {}
 
     def open(self):
         if self.closed is None:
@@ -50,12 +58,14 @@ class Serializer:
             raise SerializerError("serializer is closed")
         self.emit(DocumentStartEvent(explicit=self.use_explicit_start,
             version=self.use_version, tags=self.use_tags))
-        self.anchor_node(node)
+        if self.shared_nodes:
+            self.anchor_node(node)
         self.serialize_node(node, None, None)
         self.emit(DocumentEndEvent(explicit=self.use_explicit_end))
         self.serialized_nodes = {}
         self.anchors = {}
         self.last_anchor_id = 0
+        self.shared_nodes = True
 
     def anchor_node(self, node):
         if node in self.anchors:
@@ -76,16 +86,19 @@ class Serializer:
         return self.ANCHOR_TEMPLATE % self.last_anchor_id
 
     def serialize_node(self, node, parent, index):
-        alias = self.anchors[node]
-        if node in self.serialized_nodes:
+        if self.shared_nodes:
+            alias = self.anchors[node]
+        else:
+            # Without shared nodes there are neither anchors nor aliases.
+            alias = None
+        if alias is not None and node in self.serialized_nodes:
             self.emit(AliasEvent(alias))
         else:
-            self.serialized_nodes[node] = True
+            if alias is not None:
+                self.serialized_nodes[node] = True
             self.descend_resolver(parent, index)
             if isinstance(node, ScalarNode):
-                detected_tag = self.resolve(ScalarNode, node.value, (True, False))
-                default_tag = self.resolve(ScalarNode, node.value, (False, True))
-                implicit = (node.tag == detected_tag), (node.tag == default_tag)
+                implicit = self.implicit_scalar(node)
                 self.emit(ScalarEvent(alias, node.tag, implicit, node.value,
                     style=node.style))
             elif isinstance(node, SequenceNode):
@@ -109,3 +122,18 @@ class Serializer:
                 self.emit(MappingEndEvent())
             self.ascend_resolver()
 
+    def implicit_scalar(self, node):
+        # Path resolvers make the result depend on the position of the node,
+        # otherwise it only depends on the value and the tag.
+        key = (node.value, node.tag)
+        if not self.yaml_path_resolvers and key in self.implicit_scalars:
+            return self.implicit_scalars[key]
+        detected_tag = self.resolve(ScalarNode, node.value, (True, False))
+        default_tag = self.resolve(ScalarNode, node.value, (False, True))
+        implicit = (node.tag == detected_tag), (node.tag == default_tag)
+        if not self.yaml_path_resolvers:
+            if len(self.implicit_scalars) >= self.implicit_scalars_size:
+                self.implicit_scalars.clear()
+            self.implicit_scalars[key] = implicit
+        return implicit
+
@@ -1,11 +1,14 @@
 
 class Token(object):
+    __slots__ = ('start_mark', 'end_mark')
     def __init__(self, start_mark, end_mark):
         self.start_mark = start_mark
         self.end_mark = end_mark
     def __repr__(self):
-        attributes = [key for key in self.__dict__
+        attributes = [key for cls in self.__class__.__mro__
+                for key in cls.__dict__.get('__slots__', ())
                 if not key.endswith('_mark')]
+        attributes.extend(getattr(self, '__dict__', ()))
         attributes.sort()
         arguments = ', '.join(['%s=%r' % (key, getattr(self, key))
                 for key in attributes])
@@ -16,6 +19,7 @@ class Token(object):
 
 class DirectiveToken(Token):
     id = '<directive>'
+    __slots__ = ('name', 'value')
     def __init__(self, name, value, start_mark, end_mark):
         self.name = name
         self.value = value
@@ -24,12 +28,15 @@ class DirectiveToken(Token):
 
 class DocumentStartToken(Token):
     id = '<document start>'
+    __slots__ = ()
 
 class DocumentEndToken(Token):
     id = '<document end>'
+    __slots__ = ()
 
 class StreamStartToken(Token):
     id = '<stream start>'
+    __slots__ = ('encoding',)
     def __init__(self, start_mark=None, end_mark=None,
             encoding=None):
         self.start_mark = start_mark
@@ -38,42 +45,55 @@ class StreamStartToken(Token):
 
 class StreamEndToken(Token):
     id = '<stream end>'
+    __slots__ = ()
 
 class BlockSequenceStartToken(Token):
     id = '<block sequence start>'
+    __slots__ = ()
 
 class BlockMappingStartToken(Token):
     id = '<block mapping start>'
+    __slots__ = ()
 
 class BlockEndToken(Token):
     id = '<block end>'
+    __slots__ = ()
 
 class FlowSequenceStartToken(Token):
     id = '['
+    __slots__ = ()
 
 class FlowMappingStartToken(Token):
     id = '{'
+    __slots__ = ()
 
 class FlowSequenceEndToken(Token):
     id = ']'
+    __slots__ = ()
 
 class FlowMappingEndToken(Token):
     id = '}'
+    __slots__ = ()
 
 class KeyToken(Token):
     id = '?'
+    __slots__ = ()
 
 class ValueToken(Token):
     id = ':'
+    __slots__ = ()
 
 class BlockEntryToken(Token):
     id = '-'
+    __slots__ = ()
 
 class FlowEntryToken(Token):
     id = ','
+    __slots__ = ()
 
 class AliasToken(Token):
     id = '<alias>'
+    __slots__ = ('value',)
     def __init__(self, value, start_mark, end_mark):
         self.value = value
         self.start_mark = start_mark
@@ -81,6 +101,7 @@ class AliasToken(Token):
 
 class AnchorToken(Token):
     id = '<anchor>'
+    __slots__ = ('value',)
     def __init__(self, value, start_mark, end_mark):
         self.value = value
         self.start_mark = start_mark
@@ -88,6 +109,7 @@ class AnchorToken(Token):
 
 class TagToken(Token):
     id = '<tag>'
+    __slots__ = ('value',)
     def __init__(self, value, start_mark, end_mark):
         self.value = value
         self.start_mark = start_mark
@@ -95,6 +117,7 @@ class TagToken(Token):
 
 class ScalarToken(Token):
     id = '<scalar>'
+    __slots__ = ('value', 'plain', 'style')
     def __init__(self, value, plain, start_mark, end_mark, style=None):
         self.value = value
         self.plain = plain
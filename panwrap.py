@@ -1,7 +1,18 @@
+from collections import OrderedDict
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import hashlib
+import http.client
+import json
+import multiprocessing
 import os
+import re
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 
 from .lib import md2bib
 from .lib import yaml
@@ -14,17 +25,73 @@ def _get_file_name():
     return(sublime.active_window().active_view().file_name())
 
 
-def _parse_yaml(src, src_is_file=True):
-    """src is treated as path to a file, except if src_is_file=False"""
+class YamlCache(object):
+    """Bounded LRU cache of parsed YAML, keyed by path and modification
+    time for files and by a hash of the text otherwise. Results are
+    deep-copied in and out, so callers are free to modify them."""
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        self.entries[key] = copy.deepcopy(value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return '{} hits, {} misses, {} of {} entries'.format(
+            self.hits, self.misses, len(self.entries), self.maxsize)
+
+
+YAML_CACHE = YamlCache()
+
+
+def _parse_yaml(src, src_is_file=True, keys=None):
+    """src is treated as path to a file, except if src_is_file=False.
+    If keys are given, only the values of those top-level keys are loaded"""
+    if src_is_file:
+        stat = os.stat(src)
+        key = (src, stat.st_mtime, stat.st_size)
+    else:
+        key = hashlib.sha1(src.encode('utf-8')).hexdigest()
+    if keys is not None:
+        key = (key, tuple(keys))
+    try:
+        return YAML_CACHE.get(key)
+    except KeyError:
+        pass
+    if keys is not None:
+        load = lambda stream: yaml.safe_load_keys(stream, keys)
+    else:
+        load = yaml.safe_load_flat
     if src_is_file:
-        with open(src, 'r', encoding='utf-8') as f:
-            y = yaml.safe_load(f)
+        with open(src, 'rb') as f:
+            y = load(f)
     else:
-        y = yaml.safe_load(src)
+        y = load(src)
     path_entries = ['csl', 'bibliography', 'template']
     for e in path_entries:
         if (e in y) and (y[e] is not None):
             y[e] = os.path.expanduser(y[e])
+    YAML_CACHE.put(key, y)
     return y
 
 
@@ -49,6 +116,180 @@ def _find_blocks(source, start_markers=['---'], end_markers=['---', '...']):
     return blocks
 
 
+def _template_path(template, basepath):
+    """Return the absolute path of `template`, expanding '{PANWRAP}' to the
+    plugin directory and making relative paths relative to `basepath`"""
+    panwrap_path = os.path.dirname(os.path.abspath(__file__))
+    pth = template.format(PANWRAP=panwrap_path)
+    if not os.path.isabs(pth):
+        pth = os.path.join(basepath, pth)
+    return pth
+
+
+def _setting(s):
+    splitted = s.strip('--').split('=')
+    if len(splitted) == 1:  # Add None which will be the key's value
+        splitted.append(None)
+    return splitted
+
+
+def _dict_settings(l):
+    return {k: v for k, v in [_setting(i) for i in l]}
+
+
+def _list_settings(d):
+    l = []
+    for k in d:
+        if d[k] is None:
+            l.append('--' + k)
+        else:
+            l.append('--' + k + '=' + d[k])
+    return l
+
+
+def _split_options(l):
+    """Split pandoc options into arguments, removing all spaces"""
+    return [arg for item in l for arg in item.split()]
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime, stat.st_size)
+    except OSError:
+        return None
+
+
+# Settings of default_panwrap.yaml that documents can replace or add to
+DEFAULT_SETTINGS = ['pandoc-options-default', 'in-header-lines-default',
+                    'before-body-lines-default']
+
+
+class BuildProfile(object):
+    """The parts of a build that only depend on the default settings and
+    the template: the default pandoc arguments, the contents of the
+    default header and body includes and the variables. A profile is
+    compiled once per template and reused until one of the files it was
+    compiled from changes."""
+    def __init__(self, template=None):
+        defaults_path = sublime.packages_path() + '/panwrap/'
+        self.sources = [defaults_path + 'default_panwrap.yaml',
+                        defaults_path + 'default_variables.yaml']
+        self.settings = _parse_yaml(self.sources[0])
+        self.variables = _parse_yaml(self.sources[1])
+        self._compile_defaults()
+        self.template_options = []
+        if template is not None:
+            self.template_options = ['--template', template]
+            # Load default variables from template
+            pth = os.path.splitext(template)[0] + '.yaml'
+            self.sources.append(pth)
+            try:
+                variables_loaded = _parse_yaml(pth)
+                for k, v in variables_loaded.items():
+                    self.variables[k] = v
+            except FileNotFoundError:
+                # If the template has no yaml settings, we ignore that
+                pass
+        self.versions = [_file_version(f) for f in self.sources]
+
+    def is_stale(self):
+        """Return True if any of the files changed since compiling"""
+        return [_file_version(f) for f in self.sources] != self.versions
+
+    def _compile_defaults(self):
+        options = self.settings['pandoc-options-default'] or []
+        self.option_settings = _dict_settings(options)
+        self.options = _split_options(options)
+        # Contents of the include files, None if there are no default lines
+        self.includes = {}
+        for k in ['in-header-lines', 'before-body-lines']:
+            lines = self.settings[k + '-default']
+            if lines is not None:
+                lines = ''.join(v + '\n' for v in lines)
+            self.includes[k] = lines
+
+    def with_defaults(self, settings):
+        """Return a copy of the profile in which the `*-default` entries of
+        `settings`, such as a document's panwrap_ block, replace those of
+        default_panwrap.yaml"""
+        profile = copy.copy(self)
+        profile.settings = dict(self.settings)
+        for k in DEFAULT_SETTINGS:
+            if k in settings:
+                profile.settings[k] = settings[k]
+        profile._compile_defaults()
+        return profile
+
+
+def _cache_dir(name):
+    return os.path.join(sublime.cache_path(), 'panwrap', name)
+
+
+def _prune_cache(cache_dir, maxsize):
+    """Remove all but the `maxsize` most recently used files
+
+    Files still being written (the `tmp*` files from mkstemp) are skipped,
+    and files removed by someone else in the meantime are ignored.
+    """
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return
+    entries = []
+    for name in names:
+        if name.startswith('tmp'):
+            continue
+        pth = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(pth), pth))
+        except FileNotFoundError:
+            pass
+    entries.sort(reverse=True)
+    for _, pth in entries[maxsize:]:
+        try:
+            os.remove(pth)
+        except FileNotFoundError:
+            pass
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _filter_command(name, env, cwd):
+    """Return the path of the executable for the pandoc filter `name`, or
+    None if it is not an executable that can be run directly"""
+    pth = os.path.join(cwd, os.path.expanduser(name))
+    if os.path.isfile(pth) and os.access(pth, os.X_OK):
+        return pth
+    return shutil.which(name, path=env['PATH'])
+
+
+def _include_file(contents, extension=''):
+    """Return the path of a file with `contents` in the include cache.
+    Files are named by the hash of their contents, so the same lines always
+    give the same path and are only written once."""
+    digest = hashlib.sha1(contents.encode('utf-8')).hexdigest()
+    cache_dir = _cache_dir('includes')
+    pth = os.path.join(cache_dir, digest + extension)
+    if os.path.exists(pth):
+        os.utime(pth, None)  # Mark as recently used
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so that a build running at the
+        # same time never sees a partly written include
+        fd, temp = tempfile.mkstemp(dir=cache_dir)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(contents)
+        os.replace(temp, pth)
+    return pth
+
+
 def _display_status(message, msg_type='notification', title='Panwrap:'):
     """type can be 'notification', 'success' or 'error'"""
     if sublime.platform() == 'osx':
@@ -58,6 +299,436 @@ def _display_status(message, msg_type='notification', title='Panwrap:'):
     sublime.status_message(icons[msg_type] + ' ' + title + ' ' + message)
 
 
+# Pandoc options used when reading the document into its AST, when writing
+# the AST to an output format, or both
+PANDOC_READ_OPTIONS = {
+    'from', 'read', 'parse-raw', 'metadata', 'bibliography', 'csl',
+    'citation-abbreviations', 'citeproc', 'tab-stop', 'preserve-tabs',
+    'normalize', 'old-dashes', 'indented-code-classes',
+    'default-image-extension', 'base-header-level', 'shift-heading-level-by',
+    'track-changes', 'extract-media', 'abbreviations', 'file-scope'}
+PANDOC_WRITE_OPTIONS = {
+    'template', 'variable', 'columns', 'wrap', 'no-wrap', 'toc',
+    'table-of-contents', 'toc-depth', 'number-sections', 'number-offset',
+    'standalone', 'include-in-header', 'include-before-body',
+    'include-after-body', 'latex-engine', 'latex-engine-opt', 'pdf-engine',
+    'pdf-engine-opt', 'highlight-style', 'no-highlight', 'listings',
+    'incremental', 'self-contained', 'html-q-tags', 'ascii',
+    'reference-links', 'reference-location', 'atx-headers',
+    'top-level-division', 'chapters', 'section-divs', 'email-obfuscation',
+    'id-prefix', 'title-prefix', 'css', 'reference-odt', 'reference-docx',
+    'reference-doc', 'dpi', 'eol', 'natbib', 'biblatex', 'mathjax', 'katex',
+    'webtex', 'mathml', 'latexmathml', 'slide-level', 'no-tex-ligatures',
+    'epub-cover-image', 'epub-metadata', 'epub-embed-font',
+    'epub-chapter-level', 'epub-stylesheet'}
+PANDOC_COMMON_OPTIONS = {'smart', 'data-dir', 'verbose', 'quiet',
+                         'resource-path'}
+
+# Filters that give the same result whatever the output format
+FORMAT_INDEPENDENT_FILTERS = {'pandoc-citeproc'}
+
+# Writers pandoc picks for output extensions that are not writer names
+OUTPUT_WRITERS = {'pdf': 'latex', 'tex': 'latex', 'ltx': 'latex',
+                  'md': 'markdown', 'txt': 'markdown', 'text': 'markdown',
+                  'htm': 'html', 'xhtml': 'html'}
+
+# Replaces the temporary directory, which changes with every build, in the
+# cache keys and the cached ASTs
+TEMPDIR_MARKER = '{PANWRAP_TEMPDIR}'
+
+
+def _split_pandoc_args(args):
+    """Split pandoc options into those for reading the document, including
+    the filters that can run once for all formats, and those for writing
+    it. Raises ValueError for options that are not known to be either."""
+    read, write = [], []
+    late_filters = False  # Set once a filter depends on the output format
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if not arg.startswith('--'):
+            raise ValueError(arg)
+        name, sep, value = arg[2:].partition('=')
+        option = [arg]
+        # Option values given as separate arguments
+        while i + 1 < len(args) and not args[i + 1].startswith('-'):
+            i += 1
+            option.append(args[i])
+        i += 1
+        if not sep and len(option) > 1:
+            value = option[1]
+        if name in ['filter', 'lua-filter']:
+            if os.path.basename(value) not in FORMAT_INDEPENDENT_FILTERS:
+                late_filters = True
+            targets = [write] if late_filters else [read]
+        elif name in PANDOC_READ_OPTIONS:
+            targets = [read]
+        elif name in PANDOC_WRITE_OPTIONS:
+            targets = [write]
+        elif name in PANDOC_COMMON_OPTIONS:
+            targets = [read, write]
+        else:
+            raise ValueError(arg)
+        for target in targets:
+            target.extend(option)
+    return read, write
+
+
+def _split_filters(args):
+    """Return the `--filter` programs in pandoc `args` and the other
+    arguments"""
+    filters, other = [], []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--filter':
+            filters.append(args[i + 1])
+            i += 1
+        elif arg.startswith('--filter='):
+            filters.append(arg.split('=', 1)[1])
+        else:
+            other.append(arg)
+        i += 1
+    return filters, other
+
+
+def _writer_name(args, output):
+    """Return the name of the writer pandoc uses for the file extension
+    `output` with the writing options `args`, which it also passes to the
+    filters"""
+    writer = OUTPUT_WRITERS.get(output, output)
+    for i, arg in enumerate(args):
+        if arg.startswith(('--to=', '--write=')):
+            writer = arg.split('=', 1)[1]
+        elif arg in ('--to', '--write') and i + 1 < len(args):
+            writer = args[i + 1]
+    # Without extensions such as markdown+smart
+    return re.split(r'[+-]', writer)[0]
+
+
+# Filters that only fill in the citations and the reference section, so
+# that they can be run on a document holding just those
+CITATION_FILTERS = {'pandoc-citeproc'}
+
+
+def _ast_parts(doc):
+    """Return the metadata and the blocks of a pandoc JSON AST, in the
+    object format of pandoc 1.18 and later or the older list format"""
+    if isinstance(doc, dict):
+        return doc['meta'], doc['blocks']
+    return doc[0]['unMeta'], doc[1]
+
+
+def _ast_with(doc, meta, blocks):
+    """Return a JSON AST in the format of `doc` with `meta` and `blocks`"""
+    if isinstance(doc, dict):
+        doc = dict(doc)
+        doc['meta'] = meta
+        doc['blocks'] = blocks
+        return doc
+    return [{'unMeta': meta}, blocks]
+
+
+def _ast_elements(node):
+    """Yield the pandoc elements in `node` in document order"""
+    if isinstance(node, list):
+        for item in node:
+            yield from _ast_elements(item)
+    elif isinstance(node, dict) and 't' in node:
+        yield node
+        yield from _ast_elements(node.get('c'))
+
+
+def _meta_text(value):
+    """Return the plain text of a metadata value, or None if it has any
+    formatting"""
+    if value.get('t') == 'MetaString':
+        return value['c']
+    if value.get('t') != 'MetaInlines':
+        return None
+    text = []
+    for inline in value['c']:
+        if inline['t'] == 'Str':
+            text.append(inline['c'])
+        elif inline['t'] in ('Space', 'SoftBreak'):
+            text.append(' ')
+        else:
+            return None
+    return ''.join(text)
+
+
+def _is_note_style(csl):
+    """Return True if the CSL style at `csl` puts citations in footnotes,
+    or if it cannot be read"""
+    try:
+        with open(csl, encoding='utf-8') as f:
+            style = f.read(4096)
+    except (OSError, UnicodeDecodeError):
+        return True
+    return re.search(r'<style\b[^>]*\bclass="note"', style) is not None
+
+
+def _citation_ast(doc, csl, cwd):
+    """Return a document with the metadata, citations and reference section
+    of `doc` only, or None if the output of a citation filter may depend on
+    anything else. The citations are taken out of `doc` as they are, so
+    that they can be replaced by `_merge_citations`."""
+    meta, blocks = _ast_parts(doc)
+    if csl is None:
+        style = meta.get('csl') or meta.get('citation-style')
+        csl = _meta_text(style) if style is not None else None
+        if style is not None and csl is None:
+            return None
+    if csl is not None and _is_note_style(
+            os.path.join(cwd, os.path.expanduser(csl))):
+        # Note styles also move the punctuation around citations
+        return None
+    cites = []
+    refs = []
+    for element in _ast_elements(blocks):
+        if element['t'] == 'Cite':
+            cites.append(element)
+        elif element['t'] == 'Div' and element['c'][0][0] == 'refs':
+            refs.append(element)
+    if refs and (len(refs) > 1 or not any(b is refs[0] for b in blocks)):
+        # Only a reference section at the top level can be put back
+        return None
+    citation_blocks = [{'t': 'Para', 'c': [cite]} for cite in cites] + refs
+    return _ast_with(doc, meta, citation_blocks)
+
+
+def _merge_citations(doc, citations, filtered):
+    """Put the citations and reference section of `filtered`, the filtered
+    `citations` document of `doc`, into `doc`. Returns False, leaving `doc`
+    unchanged, if they do not match."""
+    meta, blocks = _ast_parts(doc)
+    citation_blocks = _ast_parts(citations)[1]
+    filtered_meta, filtered_blocks = _ast_parts(filtered)
+    cites = [b['c'][0] for b in citation_blocks if b['t'] == 'Para']
+    count = len(cites)
+    new_cites = [e for e in _ast_elements(filtered_blocks[:count])
+                 if e['t'] == 'Cite']
+    if len(new_cites) != count:
+        return False
+    for cite, new_cite in zip(cites, new_cites):
+        cite.clear()
+        cite.update(new_cite)
+    references = filtered_blocks[count:]
+    refs = [b for b in citation_blocks if b['t'] == 'Div']
+    if refs:
+        i = next(i for i, b in enumerate(blocks) if b is refs[0])
+        blocks[i:i + 1] = references
+    else:
+        blocks.extend(references)
+    meta.clear()
+    meta.update(filtered_meta)
+    return True
+
+
+# Separates the document from the chapters listed in `include`
+CHAPTER_MARKER = '<!-- panwrap-chapter -->'
+
+# Outputs that can be assembled from separately converted chapters
+SPLIT_OUTPUTS = ['pdf', 'tex', 'latex']
+
+# Options that only matter for the complete document, not for chapters
+CHAPTER_EXCLUDED_OPTIONS = {
+    'template', 'standalone', 'include-in-header', 'include-before-body',
+    'include-after-body', 'toc', 'table-of-contents', 'toc-depth',
+    'variable', 'self-contained', 'latex-engine', 'latex-engine-opt',
+    'pdf-engine', 'pdf-engine-opt'}
+
+# Template for chapter fragments: the LaTeX body, followed by the template
+# variables the LaTeX writer sets depending on the contents
+CHAPTER_VARIABLES = ['tables', 'graphics', 'strikeout', 'subscript', 'url',
+                     'verbatim-in-note', 'csl-refs', 'subparagraph']
+CHAPTER_TEMPLATE = (
+    '$body$\n%%PANWRAP-VARIABLES%%\n'
+    + ''.join('$if({0})${0}\n$endif$'.format(v) for v in CHAPTER_VARIABLES)
+    + '$if(highlighting-macros)$highlighting-macros\n'
+      '$highlighting-macros$\n$endif$')
+
+
+def _split_chapters(blocks):
+    """Split the blocks of a pandoc AST into chapters, which start at
+    top-level headings and at chapter markers"""
+    chapters = [[]]
+    for block in blocks:
+        if block.get('t') == 'RawBlock' \
+                and block['c'][1].strip() == CHAPTER_MARKER:
+            chapters.append([])
+            continue
+        if block.get('t') == 'Header' and block['c'][0] == 1 \
+                and chapters[-1]:
+            chapters.append([])
+        chapters[-1].append(block)
+    return [c for c in chapters if c]
+
+
+def _chapter_args(write_args):
+    """Return the writing options that apply to chapter fragments"""
+    args = []
+    excluded = False
+    for arg in write_args:
+        if arg.startswith('--'):
+            name = arg[2:].partition('=')[0]
+            excluded = name in CHAPTER_EXCLUDED_OPTIONS
+        if not excluded:
+            args.append(arg)
+    return args
+
+
+class PandocServerFallback(Exception):
+    pass
+
+
+class PandocServer(object):
+    """A long-lived `pandoc server` process that converts documents sent
+    over HTTP on localhost, which saves starting pandoc for every output.
+    Conversions the server cannot do (pdf and other formats that need
+    files, filters, options without a server equivalent) raise
+    PandocServerFallback and should be left to a pandoc subprocess."""
+
+    # Output file extensions the server can write, with their formats
+    FORMATS = {'html': 'html', 'htm': 'html', 'tex': 'latex',
+               'latex': 'latex', 'md': 'markdown', 'markdown': 'markdown',
+               'rst': 'rst', 'txt': 'plain', 'json': 'json', 'org': 'org',
+               'rtf': 'rtf', 'textile': 'textile', 'native': 'native'}
+
+    # Options that only matter for pdf output
+    IGNORED = ['latex-engine', 'pdf-engine']
+
+    def __init__(self, port, env, start_timeout=5):
+        self.port = port
+        self.env = env
+        self.start_timeout = start_timeout
+        self.process = None
+        self.failed = False  # Don't retry for the rest of the session
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the server unless it is already running. Returns False if
+        the server is not available."""
+        with self.lock:
+            return self._start()
+
+    def _start(self):
+        if self.failed:
+            return False
+        if self.process is not None and self.process.poll() is None:
+            return True
+        try:
+            self.process = subprocess.Popen(
+                ['pandoc', 'server', '--port', str(self.port)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                env=self.env)
+        except OSError:
+            self.failed = True
+            return False
+        deadline = time.time() + self.start_timeout
+        while time.time() < deadline and self.process.poll() is None:
+            try:
+                self.request('GET', '/version')
+                return True
+            except (OSError, http.client.HTTPException,
+                    PandocServerFallback):
+                time.sleep(0.05)
+        print('Pandoc server not available, using pandoc processes.')
+        self.stop()
+        self.failed = True
+        return False
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.process = None
+
+    def request(self, method, url, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port,
+                                                timeout=60)
+        try:
+            headers = {'Accept': 'application/json'}
+            if body is not None:
+                body = json.dumps(body).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, url, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise PandocServerFallback(data.decode('utf-8', 'replace'))
+        return data
+
+    def options(self, args):
+        """Translate pandoc command line arguments to server options"""
+        options = {'from': 'markdown', 'standalone': False}
+        variables = {}
+        args = list(args[1:])  # Skip the pandoc executable
+        while args:
+            arg = args.pop(0)
+            if not arg.startswith('--'):
+                raise PandocServerFallback(arg)
+            name, sep, value = arg[2:].partition('=')
+            if not sep and name in ['template', 'filter', 'from', 'to']:
+                if not args:
+                    raise PandocServerFallback(arg)
+                value = args.pop(0)
+            if name in self.IGNORED:
+                pass
+            elif name in ['from', 'to']:
+                options[name] = value
+            elif name == 'columns':
+                options['columns'] = int(value)
+            elif name in ['toc', 'table-of-contents']:
+                options['table-of-contents'] = True
+            elif name == 'toc-depth':
+                options['toc-depth'] = int(value)
+            elif name == 'number-sections':
+                options['number-sections'] = True
+            elif name == 'standalone':
+                options['standalone'] = True
+            elif name == 'template':
+                with open(value, encoding='utf-8') as f:
+                    options['template'] = f.read()
+                options['standalone'] = True
+            elif name in ['include-in-header', 'include-before-body']:
+                # These are how pandoc passes includes to the template
+                variable = {'include-in-header': 'header-includes',
+                            'include-before-body': 'include-before'}[name]
+                with open(value, encoding='utf-8') as f:
+                    variables.setdefault(variable, []).append(f.read())
+                options['standalone'] = True
+            else:
+                raise PandocServerFallback(arg)
+        if variables:
+            options['variables'] = variables
+        return options
+
+    def convert(self, args, source, output):
+        """Convert `source` as pandoc with `args` would when writing to the
+        file `output`"""
+        options = self.options(args)
+        if 'to' not in options:
+            extension = os.path.splitext(output)[1][1:]
+            if extension not in self.FORMATS:
+                raise PandocServerFallback(extension)
+            options['to'] = self.FORMATS[extension]
+        elif options['to'] not in self.FORMATS.values():
+            raise PandocServerFallback(options['to'])
+        with open(source, encoding='utf-8') as f:
+            options['text'] = f.read()
+        result = json.loads(self.request('POST', '/', options)
+                            .decode('utf-8'))
+        if result.get('base64'):
+            data = base64.b64decode(result['output'])
+        else:
+            data = result['output'].encode('utf-8')
+        with open(output, 'wb') as f:
+            f.write(data)
+
+
 class ProcessPandocCommand(sublime_plugin.ApplicationCommand):
     def run(self, **args):
         f = _get_file_name()
@@ -81,11 +752,69 @@ class PreviewCommand(sublime_plugin.ApplicationCommand):
         subprocess.call(cmd.split() + [_get_file_name()])
 
 
+class CheckBibliographyCommand(sublime_plugin.ApplicationCommand):
+    def run(self, **args):
+        f = _get_file_name()
+        sublime.set_timeout_async(lambda: PROCESSOR.check_bibliography(f), 0)
+
+
+class CitationCompletions(sublime_plugin.EventListener):
+    selector = 'text.html.markdown, text.pandoc'
+
+    def on_query_completions(self, view, prefix, locations):
+        # Only complete citation keys directly following an '@' in markdown
+        if not view.match_selector(locations[0], self.selector):
+            return None
+        if view.substr(locations[0] - len(prefix) - 1) != '@':
+            return None
+        source = view.file_name()
+        if source is None:
+            return None
+        index = PROCESSOR.bib_index(source)
+        if index is None:
+            return None
+        completions = []
+        for key in index.search(prefix):
+            description = index.describe(key)
+            if len(description) > 60:
+                description = description[:57] + '...'
+            completions.append(['{}\t{}'.format(key, description), key])
+        return completions
+
+    def on_post_save_async(self, view):
+        # The panwrap_ block may have changed the template and thus the
+        # bibliography, so look it up again on next use
+        PROCESSOR.bibliographies.pop(view.file_name(), None)
+
+
 class PandocProcessor(object):
     def plugin_loaded_setup(self):
         self.plugin_settings_file = 'panwrap.sublime-settings'
         self.plugin_settings = sublime.load_settings(self.plugin_settings_file)
         self.running = False
+        self.bibliographies = {}  # Bibliography path for each source file
+        self.bib_indexes = {}  # md2bib.BibIndex for each bibliography path
+        self.bib_errors = {}  # Version of each bibliography that failed
+        self.indexing = set()  # Source files being indexed in background
+        self.build_profiles = {}  # BuildProfile for each template path
+        self.server = None  # PandocServer, started on first use
+        self.server_lock = threading.Lock()
+        self.ast_cache_size = 64  # Number of cached ASTs and filter results
+        self.file_hashes = {}  # (version, sha1) of files by path
+        self.file_hash_cache_size = 256  # Number of remembered file hashes
+        self.chapter_cache_size = 256  # Number of cached chapter fragments
+        self.include_cache_size = 64  # Number of cached include files
+
+    def build_profile(self, template, basepath):
+        """Return the build profile for `template`, or for no template if
+        `template` is None, compiling it if necessary"""
+        if template is not None:
+            template = _template_path(template, basepath)
+        profile = self.build_profiles.get(template)
+        if profile is None or profile.is_stale():
+            profile = BuildProfile(template)
+            self.build_profiles[template] = profile
+        return profile
 
     def load_panwrap_settings(self, source):
         """Find and load panwrap settings"""
@@ -93,7 +822,8 @@ class PandocProcessor(object):
         blocks = _find_blocks(source)
         for _, block in blocks.items():
             # Try to parse the block as YAML
-            y = _parse_yaml('\n'.join(block), src_is_file=False)
+            y = _parse_yaml('\n'.join(block), src_is_file=False,
+                            keys=[panwrap_entry])
             # Try to access the panwrap_entry
             try:
                 panwrap_loaded = y[panwrap_entry]
@@ -106,6 +836,87 @@ class PandocProcessor(object):
             raise KeyError
         return panwrap_loaded
 
+    def find_bibliography(self, source):
+        """Return the path to the bibliography used when processing
+        `source`, taking into account the template's default variables.
+        Returns None for files without a panwrap_ block."""
+        try:
+            template = self.load_panwrap_settings(source).get('template')
+        except KeyError:
+            return None
+        basepath = os.path.dirname(os.path.expanduser(source))
+        variables = self.build_profile(template or None, basepath).variables
+        return variables['bibliography']
+
+    def bib_failed(self, bibliography):
+        """Return True if reading `bibliography` failed and the file has
+        not changed since"""
+        return (bibliography in self.bib_errors
+                and self.bib_errors[bibliography]
+                == _file_version(bibliography))
+
+    def update_bib_index(self, source):
+        """Return the index of the bibliography used by `source`, building
+        or rebuilding it if necessary. Returns None if no bibliography
+        is set or it cannot be read."""
+        try:
+            bibliography = self.find_bibliography(source)
+            self.bibliographies[source] = bibliography
+            if bibliography is None:
+                return None
+            index = self.bib_indexes.get(bibliography)
+            if index is None or index.is_stale():
+                if self.bib_failed(bibliography):
+                    return None
+                self.bib_indexes.pop(bibliography, None)
+                try:
+                    index = md2bib.BibIndex(bibliography)
+                except (OSError, UnicodeDecodeError) as err:
+                    # Don't try again until the file changes
+                    print('Panwrap: cannot read bibliography: {}'.format(err))
+                    self.bib_errors[bibliography] = _file_version(bibliography)
+                    return None
+                self.bib_errors.pop(bibliography, None)
+                self.bib_indexes[bibliography] = index
+            return index
+        finally:
+            self.indexing.discard(source)
+
+    def bib_index(self, source):
+        """Return the index of the bibliography used by `source` without
+        blocking. Returns None if it is not available yet; a missing or
+        outdated index is (re)built in the background."""
+        index = None
+        if source in self.bibliographies:
+            bibliography = self.bibliographies[source]
+            if bibliography is None or self.bib_failed(bibliography):
+                return None
+            index = self.bib_indexes.get(bibliography)
+            if index is not None and not index.is_stale():
+                return index
+        if source not in self.indexing:
+            self.indexing.add(source)
+            sublime.set_timeout_async(lambda: self.update_bib_index(source),
+                                      0)
+        return index
+
+    def check_bibliography(self, source):
+        """Show a report of problems found in the bibliography"""
+        index = self.update_bib_index(source)
+        if index is None:
+            bibliography = self.bibliographies.get(source)
+            if bibliography is None:
+                _display_status('No bibliography set.')
+            else:
+                _display_status('bibliography not found: {}'.format(
+                                bibliography), msg_type='error')
+            return
+        window = sublime.active_window()
+        panel = window.create_output_panel('panwrap')
+        panel.run_command('append', {'characters': '{}:\n{}\n'.format(
+                          index.source_bib, index.report)})
+        window.run_command('show_panel', {'panel': 'output.panwrap'})
+
     def process_input(self, source):
         """Process `inputfile` with pandoc.
 
@@ -129,60 +940,73 @@ class PandocProcessor(object):
     def _process_input(self, source, panwrap_loaded):
         self.running = True
         tempdir = tempfile.mkdtemp()
-        tempfiles = {}  # Keeps track of temporary files
         source = os.path.expanduser(source)
         basefile, extension = os.path.splitext(source)  # split off extension
         basepath, basefile = os.path.split(basefile)  # and split off the path
         # Initialize pandoc_exec as a list with one item
         pandoc_exec = ['pandoc']
-        panwrap = _parse_yaml(sublime.packages_path()
-                              + '/panwrap/default_panwrap.yaml')
-        variables = _parse_yaml(sublime.packages_path()
-                                + '/panwrap/default_variables.yaml')
+        profile = self.build_profile(None, basepath)
+        template = panwrap_loaded.get('template',
+                                      profile.settings['template'])
+        if template is not None:
+            profile = self.build_profile(template, basepath)
+        if any(k in panwrap_loaded for k in DEFAULT_SETTINGS):
+            profile = profile.with_defaults(panwrap_loaded)
+        variables = dict(profile.variables)
 
         #
-        # Combine loaded panwrap settings with defaults_panwrap
+        # Apply the loaded panwrap settings on top of the profile
         #
-        def _setting(s):
-            splitted = s.strip('--').split('=')
-            if len(splitted) == 1:  # Add None which will be the key's value
-                splitted.append(None)
-            return splitted
-
-        def _dict_settings(l):
-            return {k: v for k, v in [_setting(i) for i in l]}
-
-        def _list_settings(d):
-            l = []
-            for k in d:
-                if d[k] is None:
-                    l.append('--' + k)
-                else:
-                    l.append('--' + k + '=' + d[k])
-            return l
-
+        panwrap = dict(profile.settings)
         p = panwrap
         for k, v in panwrap_loaded.items():
             p[k] = v
 
         # Simply add defaults + doc-specific settings for header and
         # body lines
-        keys_with_defaults = ['in-header-lines', 'before-body-lines']
-        for k in keys_with_defaults:
-            p[k] = p[k + '-default']
-            if k in panwrap_loaded.keys():
-                p[k] = p[k] + panwrap_loaded[k]
+        for k, contents in profile.includes.items():
+            lines = panwrap_loaded.get(k)
+            if lines:
+                contents = (contents or '') + ''.join(v + '\n'
+                                                      for v in lines)
+            p[k] = contents
 
         # Intelligently overwrite pandoc-options defaults from doc-speficic
         # settings
         k = 'pandoc-options'
-        p[k] = p[k + '-default']
-        if k in panwrap_loaded.keys():
-            defaults = _dict_settings(p[k + '-default'])
+        p[k] = profile.options
+        if panwrap_loaded.get(k):
+            defaults = dict(profile.option_settings)
             loaded = _dict_settings(panwrap_loaded[k])
             for kk in loaded:
                 defaults[kk] = loaded[kk]
-            p[k] = _list_settings(defaults)
+            p[k] = _split_options(_list_settings(defaults))
+
+        #
+        # Copy the document and append the chapters it includes
+        #
+        source_temp = os.path.join(tempdir, basefile + '-temp' + extension)
+        shutil.copyfile(source, source_temp)
+        includes = p.get('include') or []
+        if not isinstance(includes, list):
+            includes = [includes]
+        chapters = []
+        for include in includes:
+            pth = os.path.join(basepath, os.path.expanduser(include))
+            try:
+                with open(pth, encoding='utf-8') as f:
+                    chapters.append(f.read())
+            except FileNotFoundError:
+                shutil.rmtree(tempdir)
+                self.running = False
+                _display_status('include file not found: {}'.format(pth),
+                                msg_type='error')
+                return None
+        if chapters:
+            with open(source_temp, 'a', encoding='utf-8') as f:
+                for chapter in chapters:
+                    f.write('\n\n' + CHAPTER_MARKER + '\n\n' + chapter)
+        split = bool(p.get('split_chapters')) or bool(includes)
 
         #
         # Process panwrap settings
@@ -200,47 +1024,30 @@ class PandocProcessor(object):
             # 2. header-lines/body-lines
             elif (key == 'in-header-lines') or (key == 'before-body-lines'):
                 # Special case for header and body
-                tempfiles[key] = os.path.join(tempdir,
-                                              '{}-{}{}'.format(basefile,
-                                                               key, extension))
-                with open(tempfiles[key], 'w', encoding='utf-8') as f:
-                    [f.write(v + '\n') for v in val]
                 pandoc_exec.append('--include-{}={}'.format(
-                                   key.replace('-lines', ''), tempfiles[key]))
+                                   key.replace('-lines', ''),
+                                   _include_file(val)))
             # 3. pandoc-options
             elif key == 'pandoc-options':
-                for item in val:
-                    # Make sure that all spaces are removed
-                    pandoc_exec.extend(item.split())
-            # 4. template settings/variables default override
+                pandoc_exec.extend(val)
+            # 4. template, its variables are part of the profile
             elif key == 'template':
-                pth = val
-                # Expand panwrap plugin path if '{PANWRAP}'' is in pth
-                panwrap_path = os.path.dirname(os.path.abspath(__file__))
-                pth = pth.format(PANWRAP=panwrap_path)
-                # If pth is still relative, we make it absolute with the
-                # source file directory as base directory
-                if not os.path.isabs(pth):
-                    pth = os.path.join(basepath, pth)
-                # Add template to pandoc-exec options
-                pandoc_exec.extend(['--template', pth])
-                # Load default variables from template
-                pth = os.path.splitext(pth)[0] + '.yaml'
-                try:
-                    variables_loaded = _parse_yaml(pth)
-                    for k, v in variables_loaded.items():
-                        variables[k] = v
-                except FileNotFoundError:
-                    # If the template has no yaml settings, we ignore that
-                    pass
+                pandoc_exec.extend(profile.template_options)
             # 5. bibliography extraction
             elif key == 'extract_bibliography':
                 if val['extract']:
-                    bibsubset_file = os.path.join(tempdir, basefile + '.bib')
-                    md2bib.extract_bibliography(source,
+                    bib_format = val.get('format', 'bibtex')
+                    if bib_format == 'csl-json':
+                        bib_extension = '.json'
+                    else:
+                        bib_extension = '.bib'
+                    bibsubset_file = os.path.join(tempdir,
+                                                  basefile + bib_extension)
+                    md2bib.extract_bibliography(source_temp,
                                                 variables['bibliography'],
                                                 bibsubset_file,
-                                                include_bibtex_style=True)
+                                                include_bibtex_style=True,
+                                                output_format=bib_format)
                     if val['keep']:
                         # If set to keep, we copy the bib file into basepath
                         shutil.copy(bibsubset_file, basepath)
@@ -249,11 +1056,9 @@ class PandocProcessor(object):
         #
         # Write variables YAML block at end of temporary document
         #
-        source_temp = os.path.join(tempdir, basefile + '-temp' + extension)
-        shutil.copyfile(source, source_temp)
         with open(source_temp, 'a', encoding='utf-8') as f:
             f.write('\n---\n')
-            yaml.dump(variables, f)
+            yaml.dump_flat(variables, f)
             f.write('---\n')
 
         #
@@ -268,65 +1073,394 @@ class PandocProcessor(object):
         #
         # Do the rest in a separate thread so that Sublime Text doesn't hang
         #
+        # Files the result depends on besides the document
+        dependencies = [variables[k] for k in ['bibliography', 'csl']
+                        if variables.get(k)]
         sublime.set_timeout_async(lambda: self.async_run(tempdir, outputs,
                                   basefile, basepath, source_temp, pandoc_exec,
-                                  keep_tempfiles), 0)
+                                  keep_tempfiles, dependencies, split), 0)
+
+    def pandoc_server(self, env):
+        """Return the pandoc server, starting it if necessary, or None if
+        server mode is off or the server is not available"""
+        if not self.plugin_settings.get('pandoc_server', False):
+            return None
+        with self.server_lock:
+            # Outputs are written in parallel, so only the first one may
+            # create the server
+            if self.server is None:
+                port = self.plugin_settings.get('pandoc_server_port', 3030)
+                self.server = PandocServer(port, env)
+        if not self.server.start():
+            return None
+        return self.server
+
+    def run_pandoc(self, args, source, output, env, cwd):
+        """Convert `source` to the file `output` with pandoc `args`.
+        Returns None on success and pandoc's return code on errors."""
+        server = self.pandoc_server(env)
+        if server is not None:
+            try:
+                server.convert(args, source, output)
+                print('>>> Converted with pandoc server: ' + output)
+                return None
+            except (OSError, ValueError, http.client.HTTPException,
+                    PandocServerFallback):
+                pass
+        execute = args + ['--output=' + output] + [source]
+        print('>>> Executing: ' + ' '.join(execute))
+        try:
+            subprocess.check_output(execute, stderr=subprocess.STDOUT,
+                                    env=env, cwd=cwd)
+        except subprocess.CalledProcessError as err:
+            print('Pandoc error.')
+            print('Output: {}'.format(err.output))
+            return err.returncode
+        return None
+
+    def file_hash(self, path):
+        """Return the sha1 of the file at `path`, or None if it does not
+        exist. Hashes are remembered until the file changes."""
+        version = _file_version(path)
+        if version is None:
+            return None
+        if self.file_hashes.get(path, (None,))[0] != version:
+            # Files in temporary folders get a new path with every build
+            if len(self.file_hashes) >= self.file_hash_cache_size:
+                self.file_hashes.clear()
+            self.file_hashes[path] = (version, _file_hash(path))
+        return self.file_hashes[path][1]
+
+    def cached_ast(self, key):
+        """Return the cached AST text for `key`, or None"""
+        pth = os.path.join(_cache_dir('ast'), key + '.json')
+        try:
+            with open(pth, encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(pth, None)  # Mark as recently used
+        return text
+
+    def cache_ast(self, key, text):
+        cache_dir = _cache_dir('ast')
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=cache_dir)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp, os.path.join(cache_dir, key + '.json'))
+
+    def parse_ast(self, read_args, source, ast, tempdir, dependencies, env,
+                  cwd):
+        """Convert `source` to pandoc's JSON AST in the file `ast`, with
+        `read_args` and the filters in them applied. Parsing and every
+        filter are cached by the hash of everything they depend on, so
+        an unchanged document is not parsed again and a filter never runs
+        twice on the same input. Citation filters are given only the
+        citations, so that they do not run again when just the text around
+        them changed. Returns None on success and the return code of pandoc
+        or the filter on errors."""
+        json_tempdir = json.dumps(tempdir)[1:-1]
+        dependencies = list(dependencies)
+        filters, args = _split_filters(read_args)
+        csl = None
+        for i, arg in enumerate(args):
+            if arg.startswith(('--bibliography=', '--csl=')):
+                dependencies.append(arg.split('=', 1)[1])
+            if arg.startswith('--csl='):
+                csl = arg.split('=', 1)[1]
+            elif arg == '--csl' and i + 1 < len(args):
+                csl = args[i + 1]
+        dependency_hashes = [self.file_hash(os.path.join(cwd, pth))
+                             for pth in dependencies]
+        commands = [_filter_command(f, env, cwd) for f in filters]
+        programs = [pth or f for f, pth in zip(filters, commands)]
+        if None in commands:
+            # Leave filters panwrap cannot run itself to pandoc
+            args = read_args
+            commands = []
+
+        # 1. Parse the document
+        h = hashlib.sha1()
+        with open(source, encoding='utf-8') as f:
+            h.update(f.read().replace(tempdir, TEMPDIR_MARKER).encode('utf-8'))
+        for arg in args:
+            h.update(arg.replace(tempdir, TEMPDIR_MARKER).encode('utf-8'))
+        pandoc = shutil.which('pandoc', path=env['PATH']) or 'pandoc'
+        h.update(repr((pandoc, _file_version(pandoc))).encode('utf-8'))
+        if not commands:
+            for pth in programs:
+                h.update(repr((pth, _file_version(pth))).encode('utf-8'))
+            h.update(repr(dependency_hashes).encode('utf-8'))
+        text = self.cached_ast(h.hexdigest())
+        if text is not None:
+            print('>>> Using cached AST of ' + source)
+        else:
+            error = self.run_pandoc(['pandoc'] + args + ['--to=json'],
+                                    source, ast, env, cwd)
+            if error is not None:
+                return error
+            with open(ast, encoding='utf-8') as f:
+                text = f.read().replace(json_tempdir, TEMPDIR_MARKER)
+            self.cache_ast(h.hexdigest(), text)
+
+        # 2. Run the filters, which do not depend on the output format
+        for command in commands:
+            if os.path.basename(command) in CITATION_FILTERS:
+                # Citation filters only see the citations, so that their
+                # result is reused as long as the citations, metadata,
+                # bibliography and style stay the same
+                doc = json.loads(text)
+                citations = _citation_ast(doc, csl, cwd)
+                if citations is not None:
+                    error, filtered = self.run_filter(
+                        command, 'json', json.dumps(citations), tempdir,
+                        dependency_hashes, env, cwd)
+                    if error is not None:
+                        return error
+                    if _merge_citations(doc, citations,
+                                        json.loads(filtered)):
+                        text = json.dumps(doc)
+                        continue
+            error, text = self.run_filter(command, 'json', text, tempdir,
+                                          dependency_hashes, env, cwd)
+            if error is not None:
+                return error
+
+        with open(ast, 'w', encoding='utf-8') as f:
+            f.write(text.replace(TEMPDIR_MARKER, json_tempdir))
+        return None
+
+    def run_filter(self, command, writer, text, tempdir, dependency_hashes,
+                   env, cwd):
+        """Run the filter `command` for the output format `writer` on the
+        AST `text`, in which the temporary directory is replaced by
+        TEMPDIR_MARKER. Results are cached by the filter, the format, the
+        input and `dependency_hashes`. Returns the return code of the
+        filter on errors and its output."""
+        json_tempdir = json.dumps(tempdir)[1:-1]
+        h = hashlib.sha1()
+        h.update(repr((self.file_hash(command), writer, dependency_hashes))
+                 .encode('utf-8'))
+        h.update(text.encode('utf-8'))
+        filtered = self.cached_ast(h.hexdigest())
+        if filtered is not None:
+            print('>>> Using cached result of ' + command)
+            return None, filtered
+        print('>>> Filtering with ' + command)
+        process = subprocess.Popen([command, writer],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   env=env, cwd=cwd)
+        output, err = process.communicate(
+            text.replace(TEMPDIR_MARKER, json_tempdir).encode('utf-8'))
+        if process.returncode != 0:
+            print('Filter error.')
+            print('Output: {}'.format(err))
+            return process.returncode, None
+        filtered = output.decode('utf-8').replace(json_tempdir,
+                                                  TEMPDIR_MARKER)
+        self.cache_ast(h.hexdigest(), filtered)
+        return None, filtered
+
+    def filter_ast(self, write_args, ast, output, tempdir, env, cwd):
+        """Run the filters in `write_args`, which depend on the output
+        format, on the AST in the file `ast` for the file extension
+        `output`. Returns the return code of the filter on errors, the
+        remaining arguments and the path of the filtered AST."""
+        filters, args = _split_filters(write_args)
+        commands = [_filter_command(f, env, cwd) for f in filters]
+        if (not commands or None in commands
+                or any(arg.startswith('--lua-filter') for arg in args)):
+            # Leave filters panwrap cannot run itself, or in the order
+            # pandoc would, to pandoc
+            return None, write_args, ast
+        json_tempdir = json.dumps(tempdir)[1:-1]
+        writer = _writer_name(args, output)
+        with open(ast, encoding='utf-8') as f:
+            text = f.read().replace(json_tempdir, TEMPDIR_MARKER)
+        for command in commands:
+            error, text = self.run_filter(command, writer, text, tempdir, [],
+                                          env, cwd)
+            if error is not None:
+                return error, None, None
+        filtered = '{}-{}.json'.format(os.path.splitext(ast)[0], output)
+        with open(filtered, 'w', encoding='utf-8') as f:
+            f.write(text.replace(TEMPDIR_MARKER, json_tempdir))
+        return None, args, filtered
+
+    def chapter_fragment(self, chapter, args, workdir, env, cwd):
+        """Return the LaTeX of the AST `chapter` and the template variables
+        the LaTeX writer set for it. Fragments are cached by the hash of the
+        chapter's AST, so only chapters that changed are converted again.
+        Returns None if pandoc fails."""
+        text = json.dumps(chapter, sort_keys=True)
+        pandoc = shutil.which('pandoc', path=env['PATH']) or 'pandoc'
+        h = hashlib.sha1()
+        h.update(repr((args, pandoc, _file_version(pandoc))).encode('utf-8'))
+        h.update(text.encode('utf-8'))
+        cache_dir = _cache_dir('chapters')
+        cached = os.path.join(cache_dir, h.hexdigest() + '.tex')
+        if os.path.exists(cached):
+            os.utime(cached, None)  # Mark as recently used
+        else:
+            fd, source = tempfile.mkstemp(suffix='.json', dir=workdir)
+            with open(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, output = tempfile.mkstemp(suffix='.tex', dir=cache_dir)
+            os.close(fd)
+            template = _include_file(CHAPTER_TEMPLATE, '.latex')
+            error = self.run_pandoc(['pandoc', '--from=json', '--to=latex',
+                                     '--standalone', '--template', template]
+                                    + args, source, output, env, cwd)
+            if error is not None:
+                os.remove(output)
+                return None
+            os.replace(output, cached)
+        with open(cached, encoding='utf-8') as f:
+            body, _, flags = f.read().partition('\n%%PANWRAP-VARIABLES%%\n')
+        variables = {}
+        flags, _, macros = flags.partition('highlighting-macros\n')
+        for flag in flags.split():
+            variables[flag] = None
+        if macros.strip():
+            variables['highlighting-macros'] = macros.rstrip('\n')
+        return body, variables
+
+    def render_chapters(self, write_args, ast, output, env, cwd):
+        """Write `output` from the AST in the file `ast` by converting its
+        chapters to LaTeX separately and in parallel, and then converting
+        the document with the assembled LaTeX as its body. Returns None on
+        success and pandoc's return code on errors."""
+        with open(ast, encoding='utf-8') as f:
+            doc = json.load(f)
+        # The AST is a dict since pandoc 1.18 and a list before
+        if isinstance(doc, dict):
+            blocks = doc['blocks']
+            chapters = [dict(doc, meta={}, blocks=c)
+                        for c in _split_chapters(blocks)]
+        else:
+            blocks = doc[1]
+            chapters = [[{'unMeta': {}}, c] for c in _split_chapters(blocks)]
+        args = _chapter_args(write_args)
+        workdir = os.path.dirname(ast)
+        workers = min(len(chapters), multiprocessing.cpu_count()) or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fragments = list(executor.map(
+                lambda c: self.chapter_fragment(c, args, workdir, env, cwd),
+                chapters))
+        _prune_cache(_cache_dir('chapters'), self.chapter_cache_size)
+        if None in fragments:
+            return 1
+        variables = {}
+        for _, v in fragments:
+            variables.update(v)
+        body = {'t': 'RawBlock',
+                'c': ['latex', '\n\n'.join(b for b, _ in fragments)]}
+        if isinstance(doc, dict):
+            doc['blocks'] = [body]
+        else:
+            doc[1] = [body]
+        extension = os.path.splitext(output)[1]
+        assembled = os.path.splitext(ast)[0] + extension + '.json'
+        with open(assembled, 'w', encoding='utf-8') as f:
+            json.dump(doc, f)
+        args = ['pandoc', '--from=json'] + write_args
+        for k, v in sorted(variables.items()):
+            if v is None:
+                args.append('--variable=' + k)
+            else:
+                args.append('--variable=' + k + ':' + v)
+        return self.run_pandoc(args, assembled, output, env, cwd)
 
     def async_run(self, tempdir, outputs, basefile, basepath, source_temp,
-                  pandoc_exec, keep_tempfiles=False):
+                  pandoc_exec, keep_tempfiles=False, dependencies=(),
+                  split=False):
         # Add a working marker to status bar
         view = sublime.active_window().active_view()
         view.set_status('panwrap_working', '[Panwrap is working...]')
 
-        #
-        # Set output filenames and call pandoc
-        #
-        errors = []
-        files = []
-        for output in outputs:
-            f = '{}.{}'.format(basefile, output)
-            files.append(f)
-            o = '--output=' + os.path.join(basepath, f)
-            execute = pandoc_exec + [o] + [source_temp]
-            print('>>> Executing: ' + ' '.join(execute))
+        try:
+            #
+            # Set output filenames and call pandoc
+            #
             pandoc_path = self.plugin_settings.get('pandoc_path')
             tex_path = self.plugin_settings.get('tex_path')
-            env = {'PATH': tex_path + ':' + pandoc_path + ':' + os.environ['PATH'],
+            env = {'PATH': (tex_path + ':' + pandoc_path + ':' +
+                            os.environ['PATH']),
                    'HOME': os.environ['HOME'],
                    'LANG': 'en_US.UTF-8'}  # Force UTF-8
+            files = ['{}.{}'.format(basefile, output) for output in outputs]
+            paths = [os.path.join(basepath, f) for f in files]
             try:
-                subprocess.check_output(execute, stderr=subprocess.STDOUT,
-                                        env=env, cwd=basepath)
-            except subprocess.CalledProcessError as err:
-                print('Pandoc error.')
-                errors.append(err.returncode)
-                print('Output: {}'.format(err.output))
+                read_args, write_args = _split_pandoc_args(pandoc_exec[1:])
+            except ValueError:
+                read_args = None
+            if read_args is not None and (split or len(outputs) > 1):
+                # Parse the document and run the filters once, then write all
+                # formats from the AST in parallel
+                ast = os.path.join(tempdir, basefile + '-ast.json')
+                error = self.parse_ast(read_args, source_temp, ast, tempdir,
+                                       dependencies, env, basepath)
 
-        #
-        # Clean up temporary files
-        #
-        if keep_tempfiles:
-            print('Temporary folder not deleted: {}'.format(tempdir))
-        else:
-            shutil.rmtree(tempdir)
+                def write(output, pth):
+                    error, args, source = self.filter_ast(
+                        write_args, ast, output, tempdir, env, basepath)
+                    if error is not None:
+                        return error
+                    # Chapters cannot be written separately if filters left
+                    # to pandoc need to see the whole document
+                    if split and output in SPLIT_OUTPUTS and not any(
+                            arg.startswith(('--filter', '--lua-filter'))
+                            for arg in args):
+                        return self.render_chapters(args, source, pth, env,
+                                                    basepath)
+                    return self.run_pandoc(['pandoc', '--from=json'] + args,
+                                           source, pth, env, basepath)
 
-        # Remove the working marker from status bar
-        view.erase_status('panwrap_working')
+                if error is not None:
+                    results = [error]
+                else:
+                    workers = min(len(paths),
+                                  multiprocessing.cpu_count()) or 1
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        results = list(executor.map(write, outputs, paths))
+                _prune_cache(_cache_dir('ast'), self.ast_cache_size)
+            else:
+                results = [self.run_pandoc(pandoc_exec, source_temp, pth, env,
+                                           basepath)
+                           for pth in paths]
+            errors = [r for r in results if r is not None]
+            _prune_cache(_cache_dir('includes'), self.include_cache_size)
 
-        #
-        # Display outcome
-        #
-        if len(errors) > 0:
-            _display_status('{e} error(s)'.format(e=len(errors)),
-                            msg_type='error')
-        else:
-            if len(outputs) > 1:
-                multi = 's'
+            #
+            # Clean up temporary files
+            #
+            if keep_tempfiles:
+                print('Temporary folder not deleted: {}'.format(tempdir))
             else:
-                multi = ''
-            _display_status('wrote file{m}: {f}'.format(m=multi, f=files),
-                            msg_type='success')
-        self.running = False
+                shutil.rmtree(tempdir)
+
+            #
+            # Display outcome
+            #
+            if len(errors) > 0:
+                _display_status('{e} error(s)'.format(e=len(errors)),
+                                msg_type='error')
+            else:
+                if len(outputs) > 1:
+                    multi = 's'
+                else:
+                    multi = ''
+                _display_status('wrote file{m}: {f}'.format(m=multi,
+                                                             f=files),
+                                msg_type='success')
+        finally:
+            # Remove the working marker from status bar
+            view.erase_status('panwrap_working')
+            self.running = False
 
 
 PROCESSOR = PandocProcessor()
@@ -334,3 +1468,8 @@ PROCESSOR = PandocProcessor()
 
 def plugin_loaded():
     PROCESSOR.plugin_loaded_setup()
+
+
+def plugin_unloaded():
+    if PROCESSOR.server is not None:
+        PROCESSOR.server.stop()
@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import yaml
+from lib.yaml.flatdumper import FlatDumper, FlatDumperFallback
+
+
+# Flat data
+FLAT_DATA = [
+    {'key': 'value'},
+    {'a': None, 'b': True, 'c': 1, 'd': -2.5, 'e': 'text'},
+    {'number_like': '1', 'bool_like': 'yes', 'null_like': '~'},
+    {'colon': 'needs quotes: yes', 'hash': 'a # b', 'quote': "it's"},
+    {'indicator': '- item', 'flow': '[a]', 'empty': ''},
+    {'unicode': 'caf\xe9', 'tab': 'a\tb'},
+    {'list': ['a', 'b, c', 1, True, None, 1.5]},
+    {'empty_list': []},
+    {'floats': [0.0, -0.0, 1e20, float('inf'), float('-inf')]},
+    {'backslash': '\\usepackage{xcolor}'},
+    {'lines': ['\\usepackage{xcolor}',
+               '\\definecolor{refcolor}{rgb}{0,0.25,0.5}']},
+]
+
+# Flat data written differently from the Dumper, which folds multi-line
+# strings, but loading to the same data
+MULTILINE_DATA = [
+    {'break': 'line\nbreak'},
+    {'lines': ['first\nsecond', 'x'], 'trailing': 'end\n'},
+]
+
+# Data that needs the full Dumper, and the reason
+FALLBACK_DATA = [
+    ({}, 'empty mapping'),
+    ([1, 2], 'not a mapping'),
+    ({'nested': {'a': 1}}, 'nested mapping'),
+    ({'nested': [[1]]}, 'nested sequence'),
+    ({1: 'a'}, 'non-str key'),
+    ({'k' * 200: 'a'}, 'long key'),
+    ({'bytes': b'\x00'}, 'binary value'),
+    ({'tuple': (1, 2)}, 'tuple value'),
+]
+
+
+class FlatDumperTestCase(unittest.TestCase):
+
+    def test_matches_dumper(self):
+        # The Dumper writes mappings with a sequence value in block style,
+        # as FlatDumper always does
+        for data in FLAT_DATA:
+            data = dict(data, zz_list=['x'])
+            with self.subTest(data=data):
+                self.assertEqual(FlatDumper().dump(data), yaml.dump(data))
+
+    def test_loads_like_dumper(self):
+        def loaded(text):
+            # repr tells -0.0 apart from 0.0
+            return repr(sorted(yaml.safe_load(text).items()))
+
+        for data in FLAT_DATA + MULTILINE_DATA:
+            with self.subTest(data=data):
+                self.assertEqual(loaded(yaml.dump_flat(data)),
+                                 loaded(yaml.dump(data)))
+                self.assertEqual(loaded(yaml.dump_flat(data)),
+                                 repr(sorted(data.items())))
+
+    def test_signed_zero(self):
+        # The scalar cache must not mix up values that compare equal
+        self.assertEqual(yaml.dump_flat({'a': 0.0}), 'a: 0.0\n')
+        self.assertEqual(yaml.dump_flat({'a': -0.0}), 'a: -0.0\n')
+        self.assertEqual(yaml.dump_flat({'a': 1}), 'a: 1\n')
+        self.assertEqual(yaml.dump_flat({'a': True}), 'a: true\n')
+
+    def test_fallback(self):
+        for data, reason in FALLBACK_DATA:
+            with self.subTest(reason=reason):
+                self.assertRaises(FlatDumperFallback, FlatDumper().dump, data)
+                self.assertEqual(yaml.dump_flat(data), yaml.dump(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import yaml
+from lib.yaml.flatloader import FlatLoader, FlatLoaderFallback
+
+
+# Documents inside the subset FlatLoader handles
+FLAT_DOCUMENTS = [
+    'key: value\n',
+    '# comment\nkey: value  # trailing comment\nother: 1\n',
+    "quoted: 'single # quoted'\nescaped: 'it''s'\n",
+    'ints: [1, 0x1f, -3]\nfloats: [1.5, .inf, -.Inf, .nan]\n',
+    'bools: [true, False, yes, off]\nnulls: [~, null, Null]\n',
+    'date: 2002-12-14\ntime: 2001-12-14t21:59:43.10-05:00\n',
+    "list: [a, 'b, c', 1,\n       true]\n",
+    'empty:\nnext: 1\n',
+    'nested:\n    key: value\n    deeper:\n        x: [1]\ntop: 2\n',
+    'panwrap_:\n    output: [pdf, html]\n    template:\n',
+    'fontsize: 11pt\nurl: http://example.com/a:b\n',
+    'unicode: caf\xe9 \u2014 na\xefve\n',
+    '',
+    '# only a comment\n',
+]
+
+# Documents that need the full loader, and the reason
+FALLBACK_DOCUMENTS = [
+    ('key:\tvalue\n', 'tab'),
+    ('\ufeffkey: value\n', 'byte order mark'),
+    ('- a\n- b\n', 'block sequence'),
+    ('key:\n    - a\n', 'nested block sequence'),
+    ('key: "double quoted"\n', 'double quoted scalar'),
+    ('key: {a: 1}\n', 'flow mapping'),
+    ('key: [a, [b]]\n', 'nested flow sequence'),
+    ('key: &anchor value\nother: *anchor\n', 'anchor and alias'),
+    ('key: !!str 1\n', 'tag'),
+    ('key: |\n    literal\n', 'block scalar'),
+    ('key: plain\n    continued\n', 'multi-line plain scalar'),
+    ('key: a: b\n', 'mapping in a plain scalar'),
+    ("key: 'unterminated\n", 'unterminated quote'),
+    ('? complex\n: key\n', 'complex key'),
+    ('  indented: 1\n', 'indented document'),
+    ('a: 1\n   b: 2\n', 'bad indentation'),
+    ('"quoted key": 1\n', 'quoted key'),
+    ('---\nkey: value\n', 'document marker'),
+]
+
+
+class FlatLoaderTestCase(unittest.TestCase):
+
+    def test_matches_safe_loader(self):
+        for document in FLAT_DOCUMENTS:
+            with self.subTest(document=document):
+                self.assertEqual(FlatLoader().load(document),
+                                 yaml.safe_load(document))
+
+    def test_fallback(self):
+        for document, reason in FALLBACK_DOCUMENTS:
+            with self.subTest(reason=reason):
+                self.assertRaises(FlatLoaderFallback,
+                                  FlatLoader().load, document)
+
+    def test_safe_load_flat(self):
+        for document, _ in FALLBACK_DOCUMENTS:
+            with self.subTest(document=document):
+                try:
+                    expected = yaml.safe_load(document)
+                except yaml.YAMLError as exc:
+                    self.assertRaises(type(exc), yaml.safe_load_flat,
+                                      document)
+                else:
+                    self.assertEqual(yaml.safe_load_flat(document),
+                                     expected)
+
+    def test_safe_load_flat_bytes(self):
+        document = 'key: caf\xe9\n'
+        self.assertEqual(yaml.safe_load_flat(document.encode('utf-16')),
+                         {'key': 'caf\xe9'})
+
+    def test_constructor_errors(self):
+        # Values that resolve but do not construct fail like with SafeLoader
+        self.assertRaises(ValueError, yaml.safe_load_flat,
+                          'date: 2002-13-45\n')
+
+    def test_safe_load_keys(self):
+        documents = [
+            'panwrap_: {output: pdf}\nother: !!int bad\n',
+            'panwrap_:\n    output: pdf\nother: 1\n',
+            'base: &b {panwrap_: 1, x: 2}\n<<: *b\nother: 1\n',
+        ]
+        for document in documents:
+            with self.subTest(document=document):
+                data = yaml.safe_load_keys(document, ['panwrap_'])
+                self.assertEqual(list(data), ['panwrap_'])
+
+
+if __name__ == '__main__':
+    unittest.main()
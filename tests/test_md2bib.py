@@ -0,0 +1,190 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import md2bib
+
+
+ARTICLE = '''\
+@article{doe2010,
+  author = {Doe, Jane and {Example Institute} and John Q. Public},
+  title = {The {DNA} of {\\"U}ber-caf\\'{e}s --- a {{LaTeX}} study},
+  journal = {Journal of \\& Examples},
+  year = {2010},
+  month = {mar},
+  volume = {12},
+  number = {3},
+  pages = {1--10},
+  doi = {10.1000/x_y--z},
+  url = {http://example.com/a_b~c},
+}
+'''
+
+
+def parse(text, report=None):
+    return md2bib.parse_bibtex(io.StringIO(text), report=report)
+
+
+class CslTestCase(unittest.TestCase):
+
+    def setUp(self):
+        md2bib._csl_cache.clear()
+
+    def test_entry_to_csl(self):
+        entries = parse(ARTICLE)
+        item = md2bib.entry_to_csl('doe2010', entries['doe2010'])
+        self.assertEqual(item, {
+            'id': 'doe2010',
+            'type': 'article-journal',
+            'author': [{'family': 'Doe', 'given': 'Jane'},
+                       {'literal': 'Example Institute'},
+                       {'family': 'Public', 'given': 'John Q.'}],
+            'title': 'The <span class="nocase">DNA</span> of '
+                     '\xdcber-caf\xe9s \u2014 a '
+                     '<span class="nocase">LaTeX</span> study',
+            'container-title': 'Journal of & Examples',
+            'volume': '12',
+            'issue': '3',
+            'page': '1-10',
+            'DOI': '10.1000/x_y--z',
+            'URL': 'http://example.com/a_b~c',
+            'issued': {'date-parts': [[2010, 3]]},
+        })
+
+    def test_types_and_dates(self):
+        entries = parse('@techreport{r,\n  number = {7},\n'
+                        '  year = {n.d.},\n}\n'
+                        '@misc{m,\n  year = {2001},\n}\n')
+        report = md2bib.entry_to_csl('r', entries['r'])
+        self.assertEqual(report['type'], 'report')
+        self.assertEqual(report['number'], '7')
+        self.assertEqual(report['issued'], {'literal': 'n.d.'})
+        misc = md2bib.entry_to_csl('m', entries['m'])
+        self.assertEqual(misc['type'], 'article')
+        self.assertEqual(misc['issued'], {'date-parts': [[2001]]})
+
+    def test_text(self):
+        cases = [
+            ('\\"a \\"{o} {\\"u} \\\'\\i \\v c \\c{c}',
+             '\xe4 \xf6 \xfc \xed \u010d \xe7'),
+            ('\\ss{} {\\o} \\ae', '\xdf \xf8 \xe6'),
+            ('50\\% \\$ \\_', '50% $ _'),
+            ('{Nested {braces}}', 'Nested braces'),
+        ]
+        for value, text in cases:
+            with self.subTest(value=value):
+                self.assertEqual(md2bib._csl_text(value), text)
+
+    def test_cache(self):
+        values = parse(ARTICLE)['doe2010']
+        item = md2bib.entry_to_csl('doe2010', values)
+        self.assertIs(md2bib.entry_to_csl('doe2010', values), item)
+        values['volume'] = '13'
+        self.assertEqual(md2bib.entry_to_csl('doe2010', values)['volume'],
+                         '13')
+
+    def test_emit_csl_json(self):
+        out = io.StringIO()
+        md2bib.emit_csl_json(parse(ARTICLE), out)
+        items = json.loads(out.getvalue())
+        self.assertEqual([i['id'] for i in items], ['doe2010'])
+
+
+LIBRARY = ARTICLE + '''\
+@book{smith2001,
+  author = {Smith, Adam},
+  title = {Wealth of Examples},
+  year = {2001},
+}
+@book{smith2001,
+  editor = {Smith, Adam},
+  title = {Wealth of Examples, Second Edition},
+  publisher = {Press},
+  date = {2002},
+}
+@comment{ignored}
+@article{broken2000 no comma
+@phdthesis{roe1999,
+  author = {Roe, Richard},
+  title = {On Theses},
+  institution = {University},
+  date = {1999},
+  pages = 12--14,
+}
+@inproceedings{gap,
+  title = {Gap},
+}
+'''
+
+
+class BibReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.report = md2bib.BibReport()
+        self.entries = parse(LIBRARY, self.report)
+
+    def test_duplicates(self):
+        self.assertEqual(dict(self.report.duplicates), {'smith2001': [13, 18]})
+        # The last entry is used
+        self.assertEqual(self.entries['smith2001']['date'], '2002')
+
+    def test_unparseable(self):
+        self.assertEqual([n for n, _ in self.report.unparseable], [25, 31])
+
+    def test_missing_fields(self):
+        # Biblatex names count as the required fields
+        self.assertEqual(dict(self.report.missing_fields),
+                         {'gap': ['author', 'booktitle', 'year/date']})
+
+    def test_str(self):
+        self.assertIn('smith2001 (lines 13, 18)', str(self.report))
+        self.assertEqual(str(md2bib.BibReport()), 'No problems found.')
+        self.assertFalse(md2bib.BibReport())
+        self.assertTrue(self.report)
+
+
+class BibIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.bib = os.path.join(self.tempdir, 'library.bib')
+        with open(self.bib, 'w', encoding='utf-8') as f:
+            f.write(LIBRARY)
+        self.index = md2bib.BibIndex(self.bib)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_search(self):
+        self.assertEqual(self.index.search('smi'), ['smith2001'])
+        self.assertEqual(self.index.search('EXAMP'),
+                         ['doe2010', 'smith2001'])
+        self.assertEqual(self.index.search('doe'), ['doe2010'])
+        self.assertEqual(self.index.search('zzz'), [])
+        self.assertEqual(len(self.index.search('', limit=2)), 2)
+
+    def test_describe(self):
+        self.assertEqual(self.index.describe('doe2010'),
+                         'Doe 2010: The DNA of \xdcber-caf\xe9s \u2014 a '
+                         'LaTeX study')
+
+    def test_report(self):
+        self.assertIn('smith2001', self.index.report.duplicates)
+
+    def test_is_stale(self):
+        self.assertFalse(self.index.is_stale())
+        os.utime(self.bib, (0, 0))
+        self.assertTrue(self.index.is_stale())
+        os.remove(self.bib)
+        self.assertTrue(self.index.is_stale())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import importlib
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The plugin module can only be imported inside Sublime Text, e.g. with the
+# UnitTesting package
+try:
+    import sublime
+except ImportError:
+    sublime = None
+
+if sublime is not None:
+    sys.path.insert(0, os.path.dirname(ROOT))
+    panwrap = importlib.import_module(os.path.basename(ROOT) + '.panwrap')
+
+
+@unittest.skipIf(sublime is None, 'needs Sublime Text')
+class SplitPandocArgsTestCase(unittest.TestCase):
+
+    def test_default_options(self):
+        read, write = panwrap._split_pandoc_args(
+            ['--latex-engine=lualatex', '--smart', '--parse-raw',
+             '--columns=98', '--filter', 'pandoc-citeproc'])
+        self.assertEqual(read, ['--smart', '--parse-raw', '--filter',
+                                'pandoc-citeproc'])
+        self.assertEqual(write, ['--latex-engine=lualatex', '--smart',
+                                 '--columns=98'])
+
+    def test_separate_values(self):
+        read, write = panwrap._split_pandoc_args(
+            ['--bibliography=a.bib', '--csl', 's.csl', '--template', 'x.tex',
+             '--standalone'])
+        self.assertEqual(read, ['--bibliography=a.bib', '--csl', 's.csl'])
+        self.assertEqual(write, ['--template', 'x.tex', '--standalone'])
+
+    def test_filter_order(self):
+        # Filters after one that depends on the output format have to run
+        # after it, in the write step
+        read, write = panwrap._split_pandoc_args(
+            ['--filter', 'pandoc-citeproc', '--filter=custom',
+             '--filter', 'pandoc-citeproc', '--lua-filter', 'x.lua'])
+        self.assertEqual(read, ['--filter', 'pandoc-citeproc'])
+        self.assertEqual(write, ['--filter=custom', '--filter',
+                                 'pandoc-citeproc', '--lua-filter', 'x.lua'])
+
+    def test_unknown_options(self):
+        for args in [['--unknown'], ['-s'], ['input.md']]:
+            with self.subTest(args=args):
+                self.assertRaises(ValueError, panwrap._split_pandoc_args,
+                                  args)
+
+
+if __name__ == '__main__':
+    unittest.main()